@@ -1,42 +1,81 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from groq import Groq
+from werkzeug.exceptions import RequestEntityTooLarge
+from groq import AsyncGroq
 import os
+import asyncio
+import threading
+import queue
+import time
+import atexit
 from dotenv import load_dotenv
-import json
+import orjson
+import re
+import hashlib
+import tempfile
+from collections import OrderedDict, deque
+from itertools import accumulate, islice, repeat
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import Cache, LRUCache
 from datetime import datetime, timedelta
 import sqlite3
+from importlib.util import find_spec
+from xml.sax.saxutils import escape
 try:
-    import PyPDF2
-    PDF_AVAILABLE = True
+    import fitz  # PyMuPDF
+    FITZ_AVAILABLE = True
 except ImportError:
-    PDF_AVAILABLE = False
-    print("⚠️ PyPDF2 not installed. PDF parsing will be limited.")
+    FITZ_AVAILABLE = False
 
 try:
-    from PIL import Image
-    import numpy as np
-    import cv2
-    import matplotlib
-    matplotlib.use('Agg')  # Non-interactive backend
-    import matplotlib.pyplot as plt
-    IMAGE_AVAILABLE = True
+    import PyPDF2
+    PYPDF2_AVAILABLE = True
 except ImportError:
-    IMAGE_AVAILABLE = False
+    PYPDF2_AVAILABLE = False
+
+PDF_AVAILABLE = FITZ_AVAILABLE or PYPDF2_AVAILABLE
+if not PDF_AVAILABLE:
+    print("⚠️ PyMuPDF/PyPDF2 not installed. PDF parsing will be limited.")
+
+# The image and report stacks are heavy to load and only used by the upload/report
+# routes, so only check they are installed here; they are imported on first use
+IMAGE_AVAILABLE = all(find_spec(name) is not None for name in ('PIL', 'numpy', 'cv2'))
+if not IMAGE_AVAILABLE:
     print("⚠️ Image processing libraries not installed. X-ray analysis will be limited.")
 
+REPORT_AVAILABLE = find_spec('reportlab') is not None
+if not REPORT_AVAILABLE:
+    print("⚠️ ReportLab not installed. PDF report generation will be limited.")
+
 try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
-    REPORT_AVAILABLE = True
+    import diskcache
+    DISKCACHE_AVAILABLE = True
 except ImportError:
-    REPORT_AVAILABLE = False
-    print("⚠️ ReportLab not installed. PDF report generation will be limited.")
+    DISKCACHE_AVAILABLE = False
+    print("⚠️ diskcache not installed. Groq response cache will not persist across restarts.")
 
 load_dotenv()
 
+def _json_default(obj):
+    """orjson fallback for the containers patient state is held in"""
+    if isinstance(obj, (deque, set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson for jsonify and request.json"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Initialize Groq client
@@ -53,89 +92,374 @@ if not GROQ_API_KEY or GROQ_API_KEY == '' or 'your_groq_api_key_here' in GROQ_AP
 else:
     print(f"✅ Groq API key loaded successfully (length: {len(GROQ_API_KEY)})")
     try:
-        client = Groq(api_key=GROQ_API_KEY)
+        client = AsyncGroq(api_key=GROQ_API_KEY)
         # Test the connection with a simple request
         print("✅ Groq API client initialized successfully")
     except Exception as e:
         print(f"❌ Error initializing Groq client: {str(e)}")
         client = None
 
+# Groq calls run on one long-lived event loop so the AsyncGroq connection pool is
+# never shared across loops; the sync Flask views hand their coroutines to it.
+_llm_loop = asyncio.new_event_loop()
+threading.Thread(target=_llm_loop.run_forever, name='groq-loop', daemon=True).start()
+
+def run_async(coro):
+    """Run a coroutine on the shared LLM event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _llm_loop).result()
+
+# Upper bound on Groq requests in flight at once; callers beyond it wait on the loop
+# instead of piling onto the API and tripping its rate limit
+GROQ_MAX_CONCURRENCY = int(os.getenv('GROQ_MAX_CONCURRENCY', '8'))
+_groq_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+
+# Blocking CPU/disk work (PDF parsing, Grad-CAM) runs here rather than on the request thread
+EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='blocking-work')
+
+# Exact-match cache for the deterministic (low temperature) report prompts
+COMPLETION_CACHE_SIZE = 256
+_completion_cache = OrderedDict()
+_inflight_completions = {}  # key -> Future shared by concurrent identical prompts
+_completion_disk_cache = diskcache.Cache(os.path.join(os.path.dirname(__file__), 'groq_cache')) if DISKCACHE_AVAILABLE else None
+
+async def cached_completion(messages, model, temperature, max_tokens, stop=None):
+    """Return the completion text for a prompt, reusing earlier identical calls"""
+    key = hashlib.sha256(orjson.dumps([model, messages, temperature, max_tokens, stop], option=orjson.OPT_SORT_KEYS)).hexdigest()
+    if key in _completion_cache:
+        _completion_cache.move_to_end(key)
+        return _completion_cache[key]
+    # An identical prompt already on its way to Groq: wait for that answer
+    if key in _inflight_completions:
+        return await asyncio.shield(_inflight_completions[key])
+    # Registered before the first await, so identical prompts arriving meanwhile wait on it
+    pending = _llm_loop.create_future()
+    _inflight_completions[key] = pending
+    fresh = False
+    try:
+        # diskcache does blocking file I/O; keep it off the loop thread
+        text = await _llm_loop.run_in_executor(EXECUTOR, _completion_disk_cache.get, key) if _completion_disk_cache is not None else None
+        if text is None:
+            async with _groq_slots:
+                chat_completion = await client.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stop=stop
+                )
+            text = chat_completion.choices[0].message.content
+            fresh = True
+        pending.set_result(text)
+    except asyncio.CancelledError:
+        pending.cancel()
+        raise
+    except Exception as e:
+        pending.set_exception(e)
+        pending.exception()  # Mark retrieved when nobody else was waiting
+        raise
+    finally:
+        del _inflight_completions[key]
+    _completion_cache[key] = text
+    if len(_completion_cache) > COMPLETION_CACHE_SIZE:
+        _completion_cache.popitem(last=False)
+    if fresh and _completion_disk_cache is not None:
+        await _llm_loop.run_in_executor(EXECUTOR, _completion_disk_cache.set, key, text)
+    return text
+
 # In-memory storage (in production, use a database)
-patients_data = []
-patient_conversations = {}
+patients_data = []  # Dashboard entries, kept in patient_sort_key order
+patients_index = OrderedDict()  # patient_id -> entry in patients_data, least recently updated first, high-risk entries the pruner skipped last
+_patients_lock = threading.Lock()
+# The dashboard only lists patients active recently; state for the rest stays in SQLite
+DASHBOARD_MAX_PATIENTS = int(os.getenv('DASHBOARD_MAX_PATIENTS', '1000'))
+DASHBOARD_TTL = timedelta(days=int(os.getenv('DASHBOARD_TTL_DAYS', '7')))
 
 # --- SQLite setup for risk history and alerts ---
 DB_PATH = os.path.join(os.path.dirname(__file__), 'medical.db')
 
+_db_local = threading.local()
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Return this thread's SQLite connection, opening and tuning it on first use"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        # Per-connection tuning; journal_mode=WAL is persisted in the file by init_db
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        _db_local.conn = conn
     return conn
 
+SCHEMA_SQL = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS risk_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    risk_score INTEGER NOT NULL,
+    trend_status TEXT
+);
+CREATE TABLE IF NOT EXISTS doctor_alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    risk_score INTEGER NOT NULL,
+    risk_level TEXT NOT NULL,
+    status_message TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patient_state (
+    patient_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patient_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_risk_patient_date ON risk_history(patient_id, date);
+CREATE INDEX IF NOT EXISTS idx_alerts_created ON doctor_alerts(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_history_patient_kind ON patient_history(patient_id, kind);
+"""
+
 def init_db():
+    # Once per process, even if called again (e.g. on module reload)
+    if getattr(init_db, '_done', False):
+        return
+    get_db().executescript(SCHEMA_SQL)
+    init_db._done = True
+
+def get_risk_history_from_db(patient_id: str):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS risk_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT NOT NULL,
-            date TEXT NOT NULL,
-            risk_score INTEGER NOT NULL,
-            trend_status TEXT
+    cur.execute("SELECT date, risk_score, trend_status FROM risk_history WHERE patient_id=? ORDER BY date ASC", (patient_id,))
+    rows = cur.fetchall()
+    return [dict(date=r['date'], risk_score=r['risk_score'], trend_status=r['trend_status']) for r in rows]
+
+def get_recent_risk_scores(patient_id: str, n: int = 3):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT risk_score FROM risk_history WHERE patient_id=? ORDER BY id DESC LIMIT ?", (patient_id, n))
+    return [r['risk_score'] for r in cur.fetchall()]
+
+def add_risk_and_alert(patient_id: str, risk_score: int, trend_status: str, risk_level: str, status_message: str):
+    conn = get_db()
+    now = datetime.now().isoformat()
+    with conn:
+        conn.execute(
+            "INSERT INTO risk_history (patient_id, date, risk_score, trend_status) VALUES (?,?,?,?)",
+            (patient_id, now, int(risk_score), trend_status or '')
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS doctor_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT NOT NULL,
-            risk_score INTEGER NOT NULL,
-            risk_level TEXT NOT NULL,
-            status_message TEXT NOT NULL,
-            created_at TEXT NOT NULL
+        conn.execute(
+            "INSERT INTO doctor_alerts (patient_id, risk_score, risk_level, status_message, created_at) VALUES (?,?,?,?,?)",
+            (patient_id, int(risk_score), risk_level, status_message, now)
         )
-        """
-    )
-    conn.commit()
-    conn.close()
 
-def add_risk_entry(patient_id: str, risk_score: int, trend_status: str):
+def get_doctor_alerts_from_db():
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT patient_id, risk_score, risk_level, status_message, created_at FROM doctor_alerts ORDER BY created_at DESC LIMIT 100")
+    rows = cur.fetchall()
+    return [dict(patient_id=r['patient_id'], risk_score=r['risk_score'], risk_level=r['risk_level'], status_message=r['status_message'], created_at=r['created_at']) for r in rows]
+
+def save_patient_state(patient_id: str, state: dict):
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO risk_history (patient_id, date, risk_score, trend_status) VALUES (?,?,?,?)",
-        (patient_id, datetime.now().isoformat(), int(risk_score), trend_status or '')
+        "INSERT OR REPLACE INTO patient_state (patient_id, state, updated_at) VALUES (?,?,?)",
+        (patient_id, orjson.dumps(state, default=_json_default).decode(), datetime.now().isoformat())
     )
     conn.commit()
-    conn.close()
 
-def get_risk_history_from_db(patient_id: str):
+def load_patient_state(patient_id: str):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT date, risk_score, trend_status FROM risk_history WHERE patient_id=? ORDER BY date ASC", (patient_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(date=r['date'], risk_score=r['risk_score'], trend_status=r['trend_status']) for r in rows]
+    cur.execute("SELECT state FROM patient_state WHERE patient_id=?", (patient_id,))
+    row = cur.fetchone()
+    return orjson.loads(row['state']) if row else None
 
-def add_doctor_alert(patient_id: str, risk_score: int, risk_level: str, status_message: str):
+def patient_state_exists(patient_id: str) -> bool:
     conn = get_db()
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO doctor_alerts (patient_id, risk_score, risk_level, status_message, created_at) VALUES (?,?,?,?,?)",
-        (patient_id, int(risk_score), risk_level, status_message, datetime.now().isoformat())
+    cur.execute("SELECT 1 FROM patient_state WHERE patient_id=?", (patient_id,))
+    return cur.fetchone() is not None
+
+def archive_patient_history(patient_id: str, kind: str, items: list):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO patient_history (patient_id, kind, payload) VALUES (?,?,?)",
+        [(patient_id, kind, orjson.dumps(item).decode()) for item in items]
     )
     conn.commit()
-    conn.close()
 
-def get_doctor_alerts_from_db():
+def get_patient_history_from_db(patient_id: str, kind: str):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT patient_id, risk_score, risk_level, status_message, created_at FROM doctor_alerts ORDER BY created_at DESC LIMIT 100")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(patient_id=r['patient_id'], risk_score=r['risk_score'], risk_level=r['risk_level'], status_message=r['status_message'], created_at=r['created_at']) for r in rows]
+    cur.execute("SELECT payload FROM patient_history WHERE patient_id=? AND kind=? ORDER BY id ASC", (patient_id, kind))
+    return [orjson.loads(r['payload']) for r in cur.fetchall()]
+
+class PatientStateCache(LRUCache):
+    """Bounded LRU of live patient state.
+    Evicted entries spill to the patient_state table and are rehydrated on the
+    next lookup. Writers call mark_dirty() after changing a state in place; dirty
+    entries are written back periodically and on eviction.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self._lock = threading.RLock()
+        self._dirty = set()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self._dirty.add(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return super().__contains__(key) or patient_state_exists(key)
+
+    def _load(self, key):
+        stored = load_patient_state(key)
+        if stored is None:
+            raise KeyError(key)
+        # Backfill keys older states lack, and restore the bounded deques
+        state = {**new_patient_state(key), **stored}
+        for history_key, limit in HISTORY_LIMITS.items():
+            state[history_key] = deque(state[history_key], maxlen=limit)
+        return state
+
+    def __missing__(self, key):
+        state = self._load(key)
+        # Freshly loaded, so it matches the stored copy and is not dirty
+        with self._lock:
+            super().__setitem__(key, state)
+        return state
+
+    def peek(self, key, default=None):
+        """Read-only lookup: a cached state, else the stored one without caching it,
+        so dashboard polls neither mark entries dirty nor evict live chats"""
+        with self._lock:
+            if Cache.__contains__(self, key):
+                return Cache.__getitem__(self, key)
+        try:
+            return self._load(key)
+        except KeyError:
+            return default
+
+    def mark_dirty(self, key, state=None):
+        """Record that a cached state was changed in place and needs writing back.
+        Pass the state that was changed: if it was evicted while the request still
+        held it, it is put back so the change is neither skipped by flush() nor
+        hidden behind a stale reload"""
+        with self._lock:
+            cached = Cache.__getitem__(self, key) if Cache.__contains__(self, key) else None
+            if state is not None and cached is not state:
+                super().__setitem__(key, state)
+            self._dirty.add(key)
+
+    def popitem(self):
+        with self._lock:
+            key, value = super().popitem()
+            dirty = key in self._dirty
+            self._dirty.discard(key)
+        if dirty:
+            save_patient_state(key, value)
+        return key, value
+
+    def flush(self):
+        """Write every entry changed since the last flush to SQLite"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            pending = [(key, Cache.__getitem__(self, key)) for key in dirty if Cache.__contains__(self, key)]
+        for key, state in pending:
+            try:
+                save_patient_state(key, state)
+            except Exception as e:
+                # Most likely mutated mid-serialization by a request; retry next round
+                print(f"[State] Flush failed for {key}: {str(e)}")
+                with self._lock:
+                    self._dirty.add(key)
+
+PATIENT_CACHE_SIZE = int(os.getenv('PATIENT_CACHE_SIZE', '1024'))
+STATE_FLUSH_INTERVAL = 5  # seconds
+# In-memory cap per patient; older entries are archived to patient_history
+HISTORY_LIMITS = {'conversation': 50, 'uploads': 10}
+
+patient_conversations = PatientStateCache(maxsize=PATIENT_CACHE_SIZE)
+
+def count_patient_history(patient_id: str, kind: str) -> int:
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM patient_history WHERE patient_id=? AND kind=?", (patient_id, kind))
+    return cur.fetchone()[0]
+
+def history_total(state: dict, key: str) -> int:
+    """Entries ever recorded under a history key, archived ones included.
+    States saved before totals were kept are counted from patient_history.
+    """
+    totals = state.get('totals') or {}
+    if key in totals:
+        return totals[key]
+    return count_patient_history(state['patient_id'], key) + len(state.get(key, []))
+
+def append_capped(state: dict, key: str, item: dict):
+    """Append to a bounded per-patient history deque, archiving the entry that falls off"""
+    state.setdefault('totals', {})[key] = history_total(state, key) + 1
+    items = state[key]
+    if len(items) == items.maxlen:
+        archive_patient_history(state['patient_id'], key, [items[0]])
+    items.append(item)
+    patient_conversations.mark_dirty(state['patient_id'], state)
+
+def new_patient_state(patient_id: str) -> dict:
+    """Fresh per-patient state, as stored in patient_conversations"""
+    return {
+        'patient_id': patient_id,
+        'uploads': deque(maxlen=HISTORY_LIMITS['uploads']),
+        'conversation': deque(maxlen=HISTORY_LIMITS['conversation']),
+        'risk_level': 'unknown',
+        'details': {},
+        'surgery_info': {},
+        'symptoms_asked': [],
+        'symptoms_prompted': [],
+        'last_prompted_symptom': None,
+        'dialogue_stage': 'initial',
+        'contact': {},
+        'pain_followups': {
+            'asked_location': False,
+            'asked_intensity': False
+        }
+    }
+
+def ensure_patient_state(patient_id: str) -> dict:
+    """Return the live state for a patient, creating it on first contact.
+    Callers that change it call patient_conversations.mark_dirty() afterwards.
+    """
+    if patient_id not in patient_conversations:
+        patient_conversations[patient_id] = new_patient_state(patient_id)
+    return patient_conversations[patient_id]
+
+def last_n(items, n):
+    """Last n entries of a list or deque, as a list"""
+    return list(islice(items, max(0, len(items) - n), None))
+
+def _flush_patient_states_forever():
+    while True:
+        time.sleep(STATE_FLUSH_INTERVAL)
+        patient_conversations.flush()
+
+threading.Thread(target=_flush_patient_states_forever, name='patient-state-flush', daemon=True).start()
+atexit.register(patient_conversations.flush)
 
 @app.route('/api/contact', methods=['POST'])
 def api_contact():
@@ -145,25 +469,13 @@ def api_contact():
         name = (data.get('name') or '').strip()
         phone = (data.get('phone') or '').strip()
         email = (data.get('email') or '').strip()
-        if patient_id not in patient_conversations:
-            patient_conversations[patient_id] = {
-                'patient_id': patient_id,
-                'uploads': [],
-                'conversation': [],
-                'risk_level': 'unknown',
-                'details': {},
-                'surgery_info': {},
-                'symptoms_asked': [],
-                'symptoms_prompted': [],
-                'last_prompted_symptom': None,
-                'dialogue_stage': 'initial',
-                'contact': {},
-            }
-        patient_conversations[patient_id]['contact'] = {
+        state = ensure_patient_state(patient_id)
+        state['contact'] = {
             'name': name,
             'phone': phone,
             'email': email
         }
+        patient_conversations.mark_dirty(patient_id, state)
         # Update dashboard list so name shows on card
         update_patients_list(patient_id)
         return jsonify({'status': 'ok'})
@@ -193,11 +505,11 @@ def compute_trend_status(scores: list) -> str:
     return 'stable'
 
 def build_doctor_payload(patient_id: str, score: int = None):
-    data = patient_conversations.get(patient_id, {})
+    data = patient_conversations.peek(patient_id, {})
     uploads = data.get('uploads', [])
     last_uploads = []
     try:
-        for u in uploads[-3:]:  # last up to 3
+        for u in last_n(uploads, 3):  # last up to 3
             last_uploads.append({
                 'filename': u.get('filename'),
                 'timestamp': u.get('timestamp'),
@@ -208,7 +520,7 @@ def build_doctor_payload(patient_id: str, score: int = None):
         pass
     recent_msgs = []
     try:
-        for m in data.get('conversation', [])[-5:]:
+        for m in last_n(data.get('conversation', []), 5):
             recent_msgs.append({
                 'role': m.get('role'),
                 'content': m.get('content'),
@@ -234,7 +546,7 @@ def send_email_to_doctor(patient_id: str, payload: dict = None):
     if payload:
         try:
             print("[Notify] Payload:")
-            print(json.dumps(payload, indent=2))
+            print(orjson.dumps(payload, default=_json_default, option=orjson.OPT_INDENT_2).decode())
         except Exception:
             pass
 
@@ -253,6 +565,22 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_upload_stream(file, filepath):
+    """Copy an uploaded file to disk in chunks, hashing it on the way; returns the blake2b hex digest.
+    Oversized bodies never get here: Werkzeug rejects them with a 413 (MAX_CONTENT_LENGTH).
+    """
+    digest = hashlib.blake2b()
+    with open(filepath, 'wb') as out:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -280,56 +608,49 @@ def upload_file():
         # Save file
         filename = f"{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        digest = save_upload_stream(file, filepath)
         
         # Read file content
         file_content = ""
         is_image = False
         gradcam_analysis = None
         gradcam_image_path = None
+        gradcam_size = None
+        
+        # The same bytes uploaded before by this patient (under any name): reuse that
+        # upload's extracted text and analysis instead of parsing and prompting again,
+        # unless it only holds a placeholder or an error (those get retried)
+        prior = next((u for u in reversed(patient_conversations.peek(patient_id, {}).get('uploads', []))
+                      if u.get('digest') == digest and is_reusable_upload(u)), None)
         
-        if filename.endswith('.txt'):
+        if prior is not None:
+            file_content = prior.get('content', '')
+        elif filename.endswith('.txt'):
             with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
                 file_content = f.read()
         elif filename.endswith('.pdf') and PDF_AVAILABLE:
-            file_content = extract_text_from_pdf(filepath)
+            file_content = EXECUTOR.submit(extract_text_from_pdf, filepath).result()
         elif filename.endswith('.pdf'):
-            file_content = "PDF file uploaded. Text extraction requires PyPDF2 library."
-        elif filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.dcm')):
+            file_content = "PDF file uploaded. Text extraction requires PyMuPDF or PyPDF2 library."
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.dcm')):
             is_image = True
         
-        # Analyze file with LLM
-        analysis = analyze_uploaded_data(file_content, filename)
+        if prior is not None:
+            analysis, surgery_info = prior.get('analysis', ''), prior.get('surgery_info') or {}
+        else:
+            # Analyze file and extract surgery info with LLM (both calls run concurrently).
+            # Prompts use the client's file name, not the timestamped one, so re-uploads hit the completion cache
+            analysis, surgery_info = run_async(analyze_report(file_content, file.filename))
         
         # Store patient data
-        if patient_id not in patient_conversations:
-            patient_conversations[patient_id] = {
-                'patient_id': patient_id,
-                'uploads': [],
-                'conversation': [],
-                'risk_level': 'unknown',
-                'details': {},
-                'surgery_info': {},
-                'symptoms_asked': [],
-                'symptoms_prompted': [],
-                'last_prompted_symptom': None,
-                'dialogue_stage': 'initial',
-                'contact': {},
-                'pain_followups': {
-                    'asked_location': False,
-                    'asked_intensity': False
-                }
-            }
+        state = ensure_patient_state(patient_id)
         
-        # Extract surgery information from analysis
-        surgery_info = extract_surgery_info(analysis, file_content)
-
         # If this was an image, now run Grad-CAM with surgery_info to focus highlights
         if is_image and IMAGE_AVAILABLE:
             try:
                 # If we couldn't extract surgery info from this file, fallback to any existing info for this patient
-                effective_surgery_info = surgery_info if surgery_info else patient_conversations.get(patient_id, {}).get('surgery_info', {})
-                gradcam_analysis, gradcam_image_path = analyze_xray_with_gradcam(filepath, filename, effective_surgery_info)
+                effective_surgery_info = surgery_info if surgery_info else state.get('surgery_info', {})
+                gradcam_analysis, gradcam_image_path, gradcam_size = EXECUTOR.submit(analyze_xray_with_gradcam, filepath, filename, effective_surgery_info).result()
             except Exception as e:
                 print(f"Grad-CAM analysis error: {str(e)}")
                 gradcam_analysis = f"Image uploaded. Analysis available: {str(e)}"
@@ -340,20 +661,23 @@ def upload_file():
             'analysis': analysis,
             'surgery_info': surgery_info,
             'timestamp': datetime.now().isoformat(),
-            'is_image': is_image
+            'is_image': is_image,
+            'digest': digest
         }
         
         if gradcam_analysis:
             upload_data['gradcam_analysis'] = gradcam_analysis
         if gradcam_image_path:
             upload_data['gradcam_image_path'] = gradcam_image_path
+            upload_data['gradcam_size'] = gradcam_size
         
-        patient_conversations[patient_id]['uploads'].append(upload_data)
+        append_capped(state, 'uploads', upload_data)
         
         # Update surgery info if found
         if surgery_info.get('surgery_type'):
-            patient_conversations[patient_id]['surgery_info'] = surgery_info
-            patient_conversations[patient_id]['dialogue_stage'] = 'symptoms_inquiry'
+            state['surgery_info'] = surgery_info
+            state['dialogue_stage'] = 'symptoms_inquiry'
+        patient_conversations.mark_dirty(patient_id, state)
         
         response_data = {
             'message': 'File uploaded successfully',
@@ -374,6 +698,8 @@ def upload_file():
 
         return jsonify(response_data)
     
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -394,11 +720,17 @@ def api_doctor_alerts():
         return jsonify({'error': str(e)}), 500
 
 def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
+    """Extract text from PDF file (PyMuPDF when available, else PyPDF2)"""
     if not PDF_AVAILABLE:
-        return "PDF parsing not available. Please install PyPDF2."
+        return "PDF parsing not available. Please install PyMuPDF or PyPDF2."
     
     try:
+        if FITZ_AVAILABLE:
+            # Text-only flags: skip decoding embedded images, which dominates on scanned reports
+            flags = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES
+            with fitz.open(pdf_path) as doc:
+                return "\n".join(doc[i].get_text("text", flags=flags) for i in range(min(doc.page_count, 5)))  # Limit to first 5 pages
+        
         text = ""
         with open(pdf_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
@@ -409,7 +741,17 @@ def extract_text_from_pdf(pdf_path):
     except Exception as e:
         return f"Error reading PDF: {str(e)}"
 
-def analyze_uploaded_data(content, filename):
+_SURGERY_TYPE_RE = re.compile(r'surgery type:', re.IGNORECASE)
+
+def trim_analysis(text):
+    """The formatted answer from an analysis reply: from "Surgery Type:" up to the next blank line"""
+    m = _SURGERY_TYPE_RE.search(text or '')
+    if not m:
+        return (text or '').strip()
+    end = text.find('\n\n', m.start())
+    return text[m.start():end if end >= 0 else None].strip()
+
+async def analyze_uploaded_data(content, filename):
     """Analyze uploaded medical data using Groq LLM - Focus on surgery identification"""
     if not client:
         return "Error: Groq API is not configured. Please add GROQ_API_KEY to your .env file."
@@ -431,28 +773,59 @@ Content: {truncated_content}
 Format: "Surgery Type: [type], Date: [date], Status: [status]"
 """
         
-        chat_completion = client.chat.completions.create(
+        # No server-side stop: a reply opening with "Here is the analysis:\n\n" would be
+        # cut before the answer. The blank-line cut is applied after "Surgery Type:" instead
+        text = await cached_completion(
             messages=[
                 {"role": "system", "content": "Medical surgery report analyzer. Identify surgery type precisely."},
                 {"role": "user", "content": prompt}
             ],
             model=GROQ_MODEL,
             temperature=0.2,
-            max_tokens=200
+            max_tokens=120
         )
-        
-        return chat_completion.choices[0].message.content
+        return trim_analysis(text)
     except Exception as e:
         return f"Analysis error: {str(e)}. Please check your Groq API key and connection."
 
-def extract_surgery_info(analysis, file_content):
-    """Extract structured surgery information from analysis"""
+# First JSON object in an LLM reply, allowing one level of nested braces
+_JSON_OBJ_RE = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}')
+
+# Placeholder/error text that stands in for a report we could not read
+NO_TEXT_PREFIXES = ('PDF file uploaded. Text extraction requires', 'PDF parsing not available', 'Error reading PDF:')
+
+# Analysis text returned when Groq is unconfigured or the call failed
+ANALYSIS_ERROR_PREFIXES = ('Analysis error', 'Error:')
+
+def is_reusable_upload(upload):
+    """True when an earlier upload holds real extracted text, analysis and surgery info"""
+    if (upload.get('content') or '').startswith(NO_TEXT_PREFIXES):
+        return False
+    if (upload.get('analysis') or '').startswith(ANALYSIS_ERROR_PREFIXES):
+        return False
+    # 'Unknown' is also what a failed extraction falls back to
+    return (upload.get('surgery_info') or {}).get('surgery_type') not in (None, '', 'Unknown')
+
+def default_surgery_info(surgery_type="Unknown"):
+    return {
+        "surgery_type": surgery_type,
+        "common_complications": ["infection", "bleeding", "pain", "swelling", "delayed healing"]
+    }
+
+async def extract_surgery_info(file_content, filename):
+    """Extract structured surgery information from the raw report content"""
     if not client:
         return {}
+    # Unreadable PDFs: nothing to extract from, skip the Groq call. Images arrive
+    # with empty content and still go through, as the filename carries the info
+    if file_content and file_content.startswith(NO_TEXT_PREFIXES):
+        return default_surgery_info()
     
     try:
-        # Use LLM to extract structured info
-        prompt = f"""From this analysis, extract JSON format strictly with these keys (include site/side if present, else empty string):
+        # Use LLM to extract structured info straight from the report so this
+        # call does not have to wait for analyze_uploaded_data
+        truncated_content = file_content[:2000] if len(file_content) > 2000 else file_content
+        prompt = f"""From this medical report, extract JSON format strictly with these keys (include site/side if present, else empty string):
 {{
   "surgery_type": "specific surgery name",
   "surgery_date": "date if mentioned",
@@ -462,256 +835,303 @@ def extract_surgery_info(analysis, file_content):
   "recovery_timeline": "typical recovery period"
 }}
 
-Analysis: {analysis[:700]}
+File: {filename}
+Report: {truncated_content}
 
 Return only valid JSON, no other text."""
         
-        chat_completion = client.chat.completions.create(
+        response = (await cached_completion(
             messages=[
                 {"role": "system", "content": "Extract surgery info as JSON. List common complications for the surgery type."},
                 {"role": "user", "content": prompt}
             ],
             model=GROQ_MODEL,
             temperature=0.2,
-            max_tokens=300
-        )
-        
-        response = chat_completion.choices[0].message.content.strip()
+            max_tokens=180,
+            stop=["}\n", "\n}"]  # End at the object's closing brace
+        )).strip()
+        # The stop sequence swallows the final brace; put it back
+        if response.count('{') > response.count('}'):
+            response += '}'
         # Try to extract JSON from response
-        if '{' in response:
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            json_str = response[json_start:json_end]
+        m = _JSON_OBJ_RE.search(response)
+        if m:
             try:
-                return json.loads(json_str)
+                return orjson.loads(m.group(0))
             except:
                 pass
         
         # Fallback: parse text
         surgery_type = "Unknown"
-        if "Surgery Type:" in analysis or "surgery" in analysis.lower():
+        if "surgery" in file_content.lower():
             # Try to extract from text
-            lines = analysis.split('\n')
+            lines = file_content.split('\n')
             for line in lines:
                 if 'surgery' in line.lower() or 'procedure' in line.lower():
                     surgery_type = line[:100]
                     break
         
-        return {
-            "surgery_type": surgery_type,
-            "common_complications": ["infection", "bleeding", "pain", "swelling", "delayed healing"]
-        }
+        return default_surgery_info(surgery_type)
     except Exception as e:
-        return {
-            "surgery_type": "Unknown",
-            "common_complications": ["infection", "bleeding", "pain", "swelling", "delayed healing"]
-        }
+        return default_surgery_info()
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    try:
-        data = request.json
-        patient_id = data.get('patient_id', 'patient_1')
-        message = data.get('message', '')
-        
-        # Initialize conversation if needed
-        if patient_id not in patient_conversations:
-            patient_conversations[patient_id] = {
-                'patient_id': patient_id,
-                'uploads': [],
-                'conversation': [],
-                'risk_level': 'unknown',
-                'details': {},
-                'surgery_info': {},
-                'symptoms_asked': [],
-                'symptoms_prompted': [],
-                'last_prompted_symptom': None,
-                'dialogue_stage': 'initial'
-            }
-        
-        # Add user message to conversation
-        patient_conversations[patient_id]['conversation'].append({
-            'role': 'user',
-            'content': message,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Auto-escalation: if already escalated, do not ask new questions
-        if patient_conversations[patient_id].get('dialogue_stage') == 'escalated':
-            hold_msg = "We have already notified your doctor due to severe symptoms. Please follow urgent care advice and await contact."
+async def analyze_report(file_content, filename):
+    """Run report analysis and surgery extraction concurrently"""
+    analysis, surgery_info = await asyncio.gather(
+        analyze_uploaded_data(file_content, filename),
+        extract_surgery_info(file_content, filename)
+    )
+    return analysis, surgery_info
+
+# Keyword -> tags for the single per-turn scan of a patient message. 'pain_term' and
+# 'severe_term' drive severe-pain auto-escalation; the others are tracked symptoms.
+# Keywords that share a start position (e.g. pain/painful) must share their tags.
+SYMPTOM_KEYWORDS = {
+    'pain': ('pain', 'pain_term'),
+    'painful': ('pain', 'pain_term'),
+    'hurt': ('pain', 'pain_term'),
+    'ache': ('pain', 'pain_term'),
+    'aching': ('pain_term',),
+    'sore': ('pain',),
+    'swell': ('swelling',),
+    'swelling': ('swelling',),
+    'swollen': ('swelling',),
+    'inflammation': ('swelling',),
+    'puffy': ('swelling',),
+    'bleed': ('bleeding',),
+    'bleeding': ('bleeding',),
+    'blood': ('bleeding',),
+    'hemorrhage': ('bleeding',),
+    'infection': ('infection',),
+    'infected': ('infection',),
+    'fever': ('infection',),
+    'feverish': ('infection',),
+    'pus': ('infection',),
+    'discharge': ('infection',),
+    'heal': ('delayed healing',),
+    'healing': ('delayed healing',),
+    'not healing': ('delayed healing',),
+    'slow healing': ('delayed healing',),
+    'recovery': ('delayed healing',),
+    'severe': ('severe_term',),
+    'very bad': ('severe_term',),
+    'extreme': ('severe_term',),
+    'unbearable': ('severe_term',),
+    'worst': ('severe_term',),
+    'heavy': ('severe_term',),
+    'heacy': ('severe_term',),
+}
+TRACKED_SYMPTOMS = ('pain', 'swelling', 'bleeding', 'infection', 'delayed healing')
+# Symptoms the chat works through, in the order they are asked
+KEY_SYMPTOMS = TRACKED_SYMPTOMS + ('fever', 'discharge')
+# Zero-width lookahead so overlapping keywords are all seen, as with substring checks
+_SYMPTOM_KEYWORD_RE = re.compile('(?=(' + '|'.join(map(re.escape, sorted(SYMPTOM_KEYWORDS, key=len, reverse=True))) + '))')
+
+def scan_message_keywords(text):
+    """Return the keyword tags present in a lower-cased message, in one regex pass"""
+    return {tag for m in _SYMPTOM_KEYWORD_RE.finditer(text) for tag in SYMPTOM_KEYWORDS[m.group(1)]}
+
+# Short answers that count as a reply to the last prompted symptom
+GENERIC_ACK_WORDS = frozenset(['yes', 'no', 'yeah', 'nope', 'ok', 'okay', 'fine', 'better', 'worse', 'same', 'normal'])
+_WORD_RE = re.compile(r'[a-z]+')
+
+def is_generic_ack(text):
+    """True if a lower-cased message contains a generic yes/no style answer"""
+    return not GENERIC_ACK_WORDS.isdisjoint(_WORD_RE.findall(text)) or 'not sure' in text
+
+def first_question_only(txt: str) -> str:
+    """Trim a reply to its first question when it asks more than one"""
+    head, sep, tail = (txt or '').partition('?')
+    if sep and '?' in tail:
+        return head + sep
+    return txt
+
+def handle_chat_turn(data, on_token=None):
+    """Run one patient chat turn and return the response payload.
+    When on_token is given, LLM tokens are passed to it as they are generated.
+    """
+    patient_id = data.get('patient_id', 'patient_1')
+    message = data.get('message', '')
+    
+    # Initialize conversation if needed
+    state = ensure_patient_state(patient_id)
+    
+    # Scan the message once for symptom and severity keywords
+    uml = (message or '').lower()
+    message_tags = scan_message_keywords(uml)
+    
+    # Add user message to conversation
+    append_capped(state, 'conversation', {
+        'role': 'user',
+        'content': message,
+        'timestamp': datetime.now().isoformat()
+    })
+    
+    # Auto-escalation: if already escalated, do not ask new questions
+    if state.get('dialogue_stage') == 'escalated':
+        hold_msg = "We have already notified your doctor due to severe symptoms. Please follow urgent care advice and await contact."
+        response = {
+            'message': hold_msg,
+            'risk_level': state.get('risk_level', 'high'),
+            'details': {'escalated': True}
+        }
+    else:
+        # Pre-detect severe pain and auto-escalate before calling LLM
+        if 'pain_term' in message_tags and 'severe_term' in message_tags:
+            state['dialogue_stage'] = 'escalated'
             response = {
-                'message': hold_msg,
-                'risk_level': patient_conversations[patient_id].get('risk_level', 'high'),
-                'details': {'escalated': True}
+                'message': "Severe pain detected. I'm escalating your case to the doctor now. If symptoms are intense, please seek urgent care immediately.",
+                'risk_level': 'high',
+                'details': {'severity': 'severe', 'escalated': True}
             }
         else:
-            # Pre-detect severe pain and auto-escalate before calling LLM
-            uml = (message or '').lower()
-            pain_terms = any(w in uml for w in ['pain', 'hurt', 'ache', 'aching', 'painful'])
-            severe_terms = any(w in uml for w in ['severe', 'very bad', 'extreme', 'unbearable', 'worst', 'heavy', 'heacy'])
-            if pain_terms and severe_terms:
-                patient_conversations[patient_id]['dialogue_stage'] = 'escalated'
-                response = {
-                    'message': "Severe pain detected. I'm escalating your case to the doctor now. If symptoms are intense, please seek urgent care immediately.",
-                    'risk_level': 'high',
-                    'details': {'severity': 'severe', 'escalated': True}
-                }
-            else:
-                # Get LLM response with language support
-                language = data.get('language', 'en')
-                response = get_chat_response(patient_id, message, language)
-
-        # Enforce one-question-per-turn: keep only the first question if multiple are present
-        def _first_question_only(txt: str) -> str:
+            # Get LLM response with language support
+            language = data.get('language', 'en')
+            response, state_updates = run_async(get_chat_response(state, message, language, on_token))
+            state.update(state_updates)
+
+    # Enforce one-question-per-turn: keep only the first question if multiple are present
+    if isinstance(response, dict) and 'message' in response:
+        response['message'] = first_question_only(response.get('message') or '')
+    
+    # Add assistant response to conversation
+    append_capped(state, 'conversation', {
+        'role': 'assistant',
+        'content': response['message'],
+        'timestamp': datetime.now().isoformat()
+    })
+    
+    # Update risk level if assessed, log risk history and alerts
+    if 'risk_level' in response:
+        lvl = response['risk_level']
+        state['risk_level'] = lvl
+        state['details'].update(response.get('details', {}))
+        # Only proceed for concrete levels
+        if lvl in ('low', 'moderate', 'medium', 'high'):
+            norm_level = 'moderate' if lvl == 'medium' else lvl
+            # Map to numeric score and store
+            score = map_level_to_score(norm_level)
+            # Expose score in API response
+            response['risk_score'] = score
+            # Inject score into assistant narrative text if not already present
             try:
-                if not txt:
-                    return txt
-                # If multiple '?', keep text up to and including the first '?'
-                qpos = txt.find('?')
-                if qpos == -1:
-                    return txt
-                # If there are additional questions after, trim
-                if txt.find('?', qpos + 1) != -1:
-                    return txt[:qpos + 1]
-                return txt
-            except Exception:
-                return txt
-
-        if isinstance(response, dict) and 'message' in response:
-            response['message'] = _first_question_only(response.get('message') or '')
-        
-        # Add assistant response to conversation
-        patient_conversations[patient_id]['conversation'].append({
-            'role': 'assistant',
-            'content': response['message'],
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Update risk level if assessed, log risk history and alerts
-        if 'risk_level' in response:
-            lvl = response['risk_level']
-            patient_conversations[patient_id]['risk_level'] = lvl
-            patient_conversations[patient_id]['details'].update(response.get('details', {}))
-            # Only proceed for concrete levels
-            if lvl in ('low', 'moderate', 'medium', 'high'):
-                norm_level = 'moderate' if lvl == 'medium' else lvl
-                # Map to numeric score and store
-                score = map_level_to_score(norm_level)
-                # Expose score in API response
-                response['risk_score'] = score
-                # Inject score into assistant narrative text if not already present
-                try:
-                    base_msg = response.get('message') or ''
-                    if 'score:' not in base_msg.lower():
-                        response['message'] = f"Risk score: {score}\n" + base_msg
-                except Exception:
-                    pass
-                # Pull previous scores for trend
-                history = get_risk_history_from_db(patient_id)
-                prev_scores = [h['risk_score'] for h in history[-3:]]  # last up to 3
-                window = prev_scores + [score]
-                trend = compute_trend_status(window) if window else 'stable'
-                add_risk_entry(patient_id, score, trend)
-
-                # Add a short trend line ONLY if there is no question in this turn
                 base_msg = response.get('message') or ''
-                if '?' not in base_msg:
-                    trend_line = ''
-                    if trend == 'improving':
-                        trend_line = "\nYour recovery trend is improving!"
-                    elif trend == 'worsening':
-                        trend_line = "\nYour condition is worsening, please consult your doctor."
-                    elif trend == 'stable':
-                        trend_line = "\nYour status appears stable at the moment."
-                    response['message'] = base_msg + trend_line
-                else:
-                    response['message'] = base_msg
-
-                # Alerts and reminders
-                status_msg = ''
-                if score > 70:
-                    # If we escalated due to severe symptoms, reflect that in status
-                    if patient_conversations[patient_id].get('dialogue_stage') == 'escalated':
-                        status_msg = 'Severe pain – CALL PATIENT NOW'
-                    else:
-                        status_msg = 'High risk – CALL PATIENT NOW'
-                    add_doctor_alert(patient_id, score, 'high', status_msg)
-                    send_email_to_doctor(patient_id, build_doctor_payload(patient_id, score))
-                elif 40 <= score <= 70:
-                    status_msg = 'Moderate risk – Follow-up scheduled in 24h'
-                    add_doctor_alert(patient_id, score, 'moderate', status_msg)
-                    schedule_reminder(patient_id)
+                if 'score:' not in base_msg.lower():
+                    response['message'] = f"Risk score: {score}\n" + base_msg
+            except Exception:
+                pass
+            # Pull previous scores for trend
+            prev_scores = list(reversed(get_recent_risk_scores(patient_id, 3)))  # last up to 3, oldest first
+            window = prev_scores + [score]
+            trend = compute_trend_status(window) if window else 'stable'
+
+            # Add a short trend line ONLY if there is no question in this turn
+            base_msg = response.get('message') or ''
+            if '?' not in base_msg:
+                trend_line = ''
+                if trend == 'improving':
+                    trend_line = "\nYour recovery trend is improving!"
+                elif trend == 'worsening':
+                    trend_line = "\nYour condition is worsening, please consult your doctor."
+                elif trend == 'stable':
+                    trend_line = "\nYour status appears stable at the moment."
+                response['message'] = base_msg + trend_line
+            else:
+                response['message'] = base_msg
+
+            # Alerts and reminders
+            if score > 70:
+                alert_level = 'high'
+                # If we escalated due to severe symptoms, reflect that in status
+                if state.get('dialogue_stage') == 'escalated':
+                    status_msg = 'Severe pain – CALL PATIENT NOW'
                 else:
-                    status_msg = 'Low risk – Preventive care suggested'
-                    add_doctor_alert(patient_id, score, 'low', status_msg)
+                    status_msg = 'High risk – CALL PATIENT NOW'
+            elif 40 <= score <= 70:
+                alert_level = 'moderate'
+                status_msg = 'Moderate risk – Follow-up scheduled in 24h'
             else:
-                # Unknown risk: do not attach a numeric score or create alerts/history
-                response.pop('risk_score', None)
-        
-        # Track symptoms being asked about or mentioned in patient responses
-        user_message_lower = data.get('message', '').lower()
-        symptoms_tracked = patient_conversations[patient_id].setdefault('symptoms_asked', [])
-        prompted = patient_conversations[patient_id].setdefault('symptoms_prompted', [])
-        last_prompted = patient_conversations[patient_id].get('last_prompted_symptom')
-        
-        # Track when patient answers about symptoms
-        if any(word in user_message_lower for word in ['pain', 'hurt', 'ache', 'sore', 'painful']):
-            if 'pain' not in symptoms_tracked:
-                symptoms_tracked.append('pain')
-            if 'pain' in prompted:
-                prompted.remove('pain')
-            if last_prompted == 'pain':
-                patient_conversations[patient_id]['last_prompted_symptom'] = None
-        if any(word in user_message_lower for word in ['swell', 'swollen', 'inflammation', 'puffy', 'swelling']):
-            if 'swelling' not in symptoms_tracked:
-                symptoms_tracked.append('swelling')
-            if 'swelling' in prompted:
-                prompted.remove('swelling')
-            if last_prompted == 'swelling':
-                patient_conversations[patient_id]['last_prompted_symptom'] = None
-        if any(word in user_message_lower for word in ['bleed', 'blood', 'hemorrhage', 'bleeding']):
-            if 'bleeding' not in symptoms_tracked:
-                symptoms_tracked.append('bleeding')
-            if 'bleeding' in prompted:
-                prompted.remove('bleeding')
-            if last_prompted == 'bleeding':
-                patient_conversations[patient_id]['last_prompted_symptom'] = None
-        if any(word in user_message_lower for word in ['infection', 'fever', 'pus', 'discharge', 'infected', 'feverish']):
-            if 'infection' not in symptoms_tracked:
-                symptoms_tracked.append('infection')
-            if 'infection' in prompted:
-                prompted.remove('infection')
-            if last_prompted == 'infection':
-                patient_conversations[patient_id]['last_prompted_symptom'] = None
-        if any(word in user_message_lower for word in ['heal', 'healing', 'recovery', 'not healing', 'slow healing']):
-            if 'delayed healing' not in symptoms_tracked:
-                symptoms_tracked.append('delayed healing')
-            if 'delayed healing' in prompted:
-                prompted.remove('delayed healing')
-            if last_prompted == 'delayed healing':
-                patient_conversations[patient_id]['last_prompted_symptom'] = None
-
-        # If user gave a generic answer to the last prompted symptom (e.g., yes/no/okay), mark it as answered
-        generic_ack_words = ['yes', 'no', 'yeah', 'nope', 'ok', 'okay', 'fine', 'better', 'worse', 'same', 'normal', 'not sure']
-        if last_prompted and (any(w in user_message_lower for w in generic_ack_words) or len(user_message_lower.split()) <= 4):
-            if last_prompted not in symptoms_tracked:
-                symptoms_tracked.append(last_prompted)
-            if last_prompted in prompted:
-                prompted.remove(last_prompted)
-            patient_conversations[patient_id]['last_prompted_symptom'] = None
-
-        # If enough symptoms addressed, mark assessment stage
-        if len(symptoms_tracked) >= 5:
-            patient_conversations[patient_id]['dialogue_stage'] = 'assessment_complete'
-        
-        # Update hospital dashboard (always keep it current)
-        update_patients_list(patient_id)
-        
-        return jsonify(response)
+                alert_level = 'low'
+                status_msg = 'Low risk – Preventive care suggested'
+            # History row and alert are written in one transaction
+            add_risk_and_alert(patient_id, score, trend, alert_level, status_msg)
+            if alert_level == 'high':
+                send_email_to_doctor(patient_id, build_doctor_payload(patient_id, score))
+            elif alert_level == 'moderate':
+                schedule_reminder(patient_id)
+        else:
+            # Unknown risk: do not attach a numeric score or create alerts/history
+            response.pop('risk_score', None)
+    
+    # Track symptoms being asked about or mentioned in patient responses
+    symptoms_tracked = state.setdefault('symptoms_asked', [])
+    prompted = state.setdefault('symptoms_prompted', [])
+    last_prompted = state.get('last_prompted_symptom')
     
+    # Track when patient answers about symptoms
+    for symptom in TRACKED_SYMPTOMS:
+        if symptom not in message_tags:
+            continue
+        if symptom not in symptoms_tracked:
+            symptoms_tracked.append(symptom)
+        if symptom in prompted:
+            prompted.remove(symptom)
+        if last_prompted == symptom:
+            state['last_prompted_symptom'] = None
+
+    # If user gave a generic answer to the last prompted symptom (e.g., yes/no/okay), mark it as answered
+    if last_prompted and (is_generic_ack(uml) or len(uml.split()) <= 4):
+        if last_prompted not in symptoms_tracked:
+            symptoms_tracked.append(last_prompted)
+        if last_prompted in prompted:
+            prompted.remove(last_prompted)
+        state['last_prompted_symptom'] = None
+
+    # If enough symptoms addressed, mark assessment stage
+    if len(symptoms_tracked) >= 5:
+        state['dialogue_stage'] = 'assessment_complete'
+    
+    patient_conversations.mark_dirty(patient_id, state)
+    
+    # Update hospital dashboard (always keep it current)
+    update_patients_list(patient_id)
+    
+    return response
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    try:
+        return jsonify(handle_chat_turn(request.json))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the assistant reply as Server-Sent Events.
+    'token' events carry raw LLM output; the final 'done' event carries the
+    scored, trimmed response that /api/chat would have returned.
+    """
+    data = request.json
+    events = queue.Queue()
+
+    def run_turn():
+        try:
+            response = handle_chat_turn(data, on_token=lambda token: events.put({'token': token}))
+            events.put({'done': True, 'response': response})
+        except Exception as e:
+            events.put({'error': str(e)})
+
+    threading.Thread(target=run_turn, daemon=True).start()
+
+    def generate():
+        while True:
+            event = events.get()
+            yield b"data: " + orjson.dumps(event, default=_json_default) + b"\n\n"
+            if 'token' not in event:
+                break
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
 def truncate_text(text, max_chars=500):
     """Truncate text to maximum characters"""
     if not text:
@@ -720,8 +1140,90 @@ def truncate_text(text, max_chars=500):
         return text
     return text[:max_chars] + "..."
 
-def get_chat_response(patient_id, user_message, language='en'):
-    """Get chat response from LLM with risk assessment and language support"""
+# Tags the model is asked to append: the assessed level and a free-text summary
+_RISK_TAG_RE = re.compile(r'\[RISK_LEVEL: (HIGH|MODERATE|LOW)\]')
+_DETAILS_TAG_RE = re.compile(r'\[DETAILS:([^\]]*)\]')
+# Substring matches, as before ('repeat' also covers 'repeated')
+_REPEAT_RE = re.compile(r'repeat|again|same question')
+_URGENT_RE = re.compile(r'severe|emergency')
+
+# The one question asked next for each symptom still to cover
+SYMPTOM_QUESTIONS = {
+    'pain': 'Can you describe the pain? Is it mild, moderate, or severe?',
+    'swelling': 'Is there any swelling at the surgical site? How would you describe it?',
+    'bleeding': 'Have you noticed any bleeding? Is it light, moderate, or heavy?',
+    'infection': 'Do you have a fever, pus, discharge, or signs of infection?',
+    'delayed healing': 'Is the wound healing normally, or are there concerns about delayed healing?'
+}
+SYMPTOM_QUESTIONS_TA = {
+    'pain': 'வலியை விவரிக்க முடியுமா? அது மிதமான, நடுத்தர, அல்லது கடுமையானதா?',
+    'swelling': 'அறுவை சிகிச்சை தளத்தில் எந்த வீக்கமும் உள்ளதா? அதை எப்படி விவரிப்பீர்கள்?',
+    'bleeding': 'நீங்கள் எந்த இரத்தப்போக்கையும் கவனித்தீர்களா? அது இலேசான, நடுத்தர, அல்லது கனமானதா?',
+    'infection': 'உங்களுக்கு காய்ச்சல், சீழ், வெளியேற்றம் அல்லது தொற்று அறிகுறிகள் உள்ளனவா?',
+    'delayed healing': 'காயம் சாதாரணமாக குணமாகிறதா, அல்லது குணமடைய தாமதம் குறித்த கவலைகள் உள்ளனவா?'
+}
+
+# Appended to low-risk replies once enough symptoms have been covered
+LOW_RISK_RECOMMENDATIONS = (
+    "\n\n💡 PREVENTIVE MEASURES & HOME CARE:\n\n"
+    "• Keep the surgical site clean and dry\n"
+    "• Take prescribed medications as directed\n"
+    "• Watch for signs of infection (fever, redness, pus)\n"
+    "• Avoid strenuous activities during recovery\n"
+    "• Follow your doctor's post-operative instructions\n\n"
+    "SUITABLE MEDICATIONS (consult doctor first):\n"
+    "• Pain management: Acetaminophen or Ibuprofen (as prescribed)\n"
+    "• Infection prevention: Keep area clean, change dressings regularly\n"
+    "• Swelling reduction: Apply ice packs, elevate if applicable\n\n"
+    "⚠️ Monitor closely. Contact doctor if symptoms worsen or persist."
+)
+
+@lru_cache(maxsize=512)
+def build_system_prompt(is_tamil, surgery_type, should_assess, symptoms_key):
+    """Language-specific system prompt; depends only on its (hashable) arguments"""
+    if is_tamil:
+        return f"""நீங்கள் ஒரு மருத்துவ உதவியாளர் பாட். அறுவை சிகிச்சைக்குப் பிறகு பராமரிப்புக்காக நோயாளிகளுக்கு உதவுகிறீர்கள். அறுவை சிகிச்சை: {surgery_type if surgery_type else 'தெரியவில்லை'}.
+
+மிக முக்கியமான விதிகள்:
+1. எல்லா கேள்விகளையும் தமிழில் மட்டுமே கேட்கவும் - ஒருபோதும் ஆங்கிலத்தில் கேட்காதீர்கள்
+2. ஒவ்வொரு பதிலுக்கும் ஒரு கேள்வியை மட்டும் கேட்கவும் - ஒருபோதும் பல கேள்விகளை ஒரே நேரத்தில் கேட்காதீர்கள்
+3. அடுத்த கேள்வியைக் கேட்க முன்பு நோயாளியின் பதிலுக்குக் காத்திருக்கவும்
+4. அனைத்து அறிகுறிகளும் மதிப்பீடு செய்யப்படும் வரை பரிந்துரைகளை வழங்காதீர்கள்
+5. எப்போதும் பச்சாதாபமாகவும் தொழில்முறையாகவும் இருங்கள்
+
+உரையாடல் பாய்வு:
+- கேட்க வேண்டிய அறிகுறிகள் (ஒரு நேரத்தில் ஒன்று): வலி, வீக்கம், இரத்தப்போக்கு, தொற்று, குணமடைய தாமதம்
+- ஒவ்வொரு பதிலுக்கும் பிறகு, அது உயர் ஆபத்து (கடுமையான/அவசர) என்பதை பகுப்பாய்வு செய்யவும் அல்லது தொடர்ந்து கேட்கவும்
+- 5 அறிகுறிகளும் கேட்கப்பட்ட பிறகு, முழுமையான ஆபத்து மதிப்பீடு மற்றும் பரிந்துரைகளை வழங்கவும்
+
+தற்போதைய நிலை: {'மதிப்பீடு' if should_assess else 'கேள்விகள் கேட்கிறது'}
+ஏற்கனவே கேட்ட அறிகுறிகள்: {', '.join(symptoms_key) if symptoms_key else 'இல்லை'}
+
+முக்கியம்: நீங்கள் அனுப்பும் எல்லா பதில்களும், கேள்விகளும், பரிந்துரைகளும் தமிழில் மட்டுமே இருக்க வேண்டும். ஆங்கிலத்தில் எதுவும் எழுத வேண்டாம்."""
+    else:
+        return f"""Medical assistant for post-surgery care. Surgery: {surgery_type if surgery_type else 'Unknown'}.
+
+CRITICAL RULES:
+1. Ask ONLY ONE question per response - never ask multiple questions at once
+2. Wait for patient's answer before asking the next question
+3. Do NOT provide recommendations until all symptoms are assessed
+4. Be empathetic and professional
+
+Dialogue flow:
+- Symptoms to ask (ONE at a time): pain, swelling, bleeding, infection, delayed healing
+- After EACH answer, analyze if it indicates HIGH RISK (severe/urgent) or continue asking
+- Only after all 5 symptoms asked, provide full risk assessment and recommendations
+
+Current stage: {'ASSESSMENT' if should_assess else 'ASKING QUESTIONS'}
+Symptoms already asked: {', '.join(symptoms_key) if symptoms_key else 'None'}
+"""
+
+async def get_chat_response(patient_data, user_message, language='en', on_token=None):
+    """Get chat response from LLM with risk assessment and language support.
+    If on_token is given, the completion is streamed and each token is passed to it.
+    Runs on the LLM loop, so patient_data is only read here; returns (response, state_updates)
+    for the caller to apply off the loop.
+    """
     if not client:
         error_msg = "Error: Groq API is not configured. Please add GROQ_API_KEY to your .env file and restart the server."
         if language == 'ta':
@@ -730,11 +1232,12 @@ def get_chat_response(patient_id, user_message, language='en'):
             'message': error_msg,
             'risk_level': 'unknown',
             'details': {}
-        }
+        }, {}
     
+    state_updates = {}
     try:
-        patient_data = patient_conversations.get(patient_id, {})
         is_tamil = language == 'ta'
+        uml = (user_message or '').lower()
         
         # Build context from uploads (truncated to save tokens)
         context = ""
@@ -748,7 +1251,7 @@ def get_chat_response(patient_id, user_message, language='en'):
         
         # Build conversation history (limit to last 3 messages, truncate each)
         conversation_history = ""
-        recent_messages = patient_data.get('conversation', [])[-3:]  # Last 3 messages only
+        recent_messages = last_n(patient_data.get('conversation', []), 3)  # Last 3 messages only
         for msg in recent_messages:
             role_name = "Patient" if msg['role'] == 'user' else "Assistant"
             content = truncate_text(msg['content'], max_chars=200)  # Limit each message to 200 chars
@@ -758,68 +1261,30 @@ def get_chat_response(patient_id, user_message, language='en'):
         surgery_info = patient_data.get('surgery_info', {})
         surgery_type = surgery_info.get('surgery_type', '')
         complications = surgery_info.get('common_complications', [])
-        symptoms_asked = patient_data.get('symptoms_asked', [])
-        symptoms_prompted = patient_data.get('symptoms_prompted', [])
+        # Copies, so updates are handed back rather than made on the live state
+        symptoms_asked = list(patient_data.get('symptoms_asked', []))
+        symptoms_prompted = list(patient_data.get('symptoms_prompted', []))
         last_prompted_symptom = patient_data.get('last_prompted_symptom', None)
-        pain_followups = patient_data.setdefault('pain_followups', {'asked_location': False, 'asked_intensity': False})
         dialogue_stage = patient_data.get('dialogue_stage', 'initial')
 
         # Handle user complaint about repeated questions: skip last prompted symptom
         try:
-            uml = user_message.lower()
-            if any(x in uml for x in ['repeat', 'repeated', 'again', 'same question']):
+            if _REPEAT_RE.search(uml):
                 if last_prompted_symptom and last_prompted_symptom not in symptoms_asked:
                     symptoms_asked.append(last_prompted_symptom)
-                    patient_conversations[patient_id]['symptoms_asked'] = symptoms_asked
+                    state_updates['symptoms_asked'] = symptoms_asked
         except Exception:
             pass
 
-        # Determine which symptoms haven't been asked
-        key_symptoms = ['pain', 'swelling', 'bleeding', 'infection', 'delayed healing', 'fever', 'discharge']
-        # Avoid re-prompting symptoms already prompted or answered
-        remaining_symptoms = [s for s in key_symptoms if s not in set(symptoms_asked + symptoms_prompted)]
+        # Next symptom not yet asked; avoid re-prompting symptoms already prompted or answered
+        covered = {*symptoms_asked, *symptoms_prompted}
+        next_symptom = next((s for s in KEY_SYMPTOMS if s not in covered), None)
         
         # Determine if we should assess risk now or continue asking
         all_key_symptoms_asked = len(symptoms_asked) >= 5 or dialogue_stage == 'assessment_complete'
-        should_assess_risk = all_key_symptoms_asked or 'severe' in user_message.lower() or 'emergency' in user_message.lower()
+        should_assess_risk = all_key_symptoms_asked or _URGENT_RE.search(uml) is not None
         
-        # Language-specific system prompts
-        if is_tamil:
-            system_prompt = f"""நீங்கள் ஒரு மருத்துவ உதவியாளர் பாட். அறுவை சிகிச்சைக்குப் பிறகு பராமரிப்புக்காக நோயாளிகளுக்கு உதவுகிறீர்கள். அறுவை சிகிச்சை: {surgery_type if surgery_type else 'தெரியவில்லை'}.
-
-மிக முக்கியமான விதிகள்:
-1. எல்லா கேள்விகளையும் தமிழில் மட்டுமே கேட்கவும் - ஒருபோதும் ஆங்கிலத்தில் கேட்காதீர்கள்
-2. ஒவ்வொரு பதிலுக்கும் ஒரு கேள்வியை மட்டும் கேட்கவும் - ஒருபோதும் பல கேள்விகளை ஒரே நேரத்தில் கேட்காதீர்கள்
-3. அடுத்த கேள்வியைக் கேட்க முன்பு நோயாளியின் பதிலுக்குக் காத்திருக்கவும்
-4. அனைத்து அறிகுறிகளும் மதிப்பீடு செய்யப்படும் வரை பரிந்துரைகளை வழங்காதீர்கள்
-5. எப்போதும் பச்சாதாபமாகவும் தொழில்முறையாகவும் இருங்கள்
-
-உரையாடல் பாய்வு:
-- கேட்க வேண்டிய அறிகுறிகள் (ஒரு நேரத்தில் ஒன்று): வலி, வீக்கம், இரத்தப்போக்கு, தொற்று, குணமடைய தாமதம்
-- ஒவ்வொரு பதிலுக்கும் பிறகு, அது உயர் ஆபத்து (கடுமையான/அவசர) என்பதை பகுப்பாய்வு செய்யவும் அல்லது தொடர்ந்து கேட்கவும்
-- 5 அறிகுறிகளும் கேட்கப்பட்ட பிறகு, முழுமையான ஆபத்து மதிப்பீடு மற்றும் பரிந்துரைகளை வழங்கவும்
-
-தற்போதைய நிலை: {'மதிப்பீடு' if should_assess_risk else 'கேள்விகள் கேட்கிறது'}
-ஏற்கனவே கேட்ட அறிகுறிகள்: {', '.join(symptoms_asked) if symptoms_asked else 'இல்லை'}
-
-முக்கியம்: நீங்கள் அனுப்பும் எல்லா பதில்களும், கேள்விகளும், பரிந்துரைகளும் தமிழில் மட்டுமே இருக்க வேண்டும். ஆங்கிலத்தில் எதுவும் எழுத வேண்டாம்."""
-        else:
-            system_prompt = f"""Medical assistant for post-surgery care. Surgery: {surgery_type if surgery_type else 'Unknown'}.
-
-CRITICAL RULES:
-1. Ask ONLY ONE question per response - never ask multiple questions at once
-2. Wait for patient's answer before asking the next question
-3. Do NOT provide recommendations until all symptoms are assessed
-4. Be empathetic and professional
-
-Dialogue flow:
-- Symptoms to ask (ONE at a time): pain, swelling, bleeding, infection, delayed healing
-- After EACH answer, analyze if it indicates HIGH RISK (severe/urgent) or continue asking
-- Only after all 5 symptoms asked, provide full risk assessment and recommendations
-
-Current stage: {'ASSESSMENT' if should_assess_risk else 'ASKING QUESTIONS'}
-Symptoms already asked: {', '.join(symptoms_asked) if symptoms_asked else 'None'}
-"""
+        system_prompt = build_system_prompt(is_tamil, str(surgery_type or ''), bool(should_assess_risk), tuple(symptoms_asked))
         
         # Build context-aware prompt
         user_context = ""
@@ -846,233 +1311,265 @@ Symptoms already asked: {', '.join(symptoms_asked) if symptoms_asked else 'None'
         if is_tamil:
             if should_assess_risk:
                 user_prompt += "\n\nஉங்களிடம் போதுமான தகவல்கள் உள்ளன. இப்போது ஆபத்து நிலையை மதிப்பீடு செய்து பரிந்துரைகளை வழங்கவும். பயன்படுத்தவும்: [RISK_LEVEL: LOW/MODERATE/HIGH]"
-            elif remaining_symptoms and dialogue_stage == 'symptoms_inquiry':
-                next_symptom = remaining_symptoms[0]
-                symptom_questions_ta = {
-                    'pain': 'வலியை விவரிக்க முடியுமா? அது மிதமான, நடுத்தர, அல்லது கடுமையானதா?',
-                    'swelling': 'அறுவை சிகிச்சை தளத்தில் எந்த வீக்கமும் உள்ளதா? அதை எப்படி விவரிப்பீர்கள்?',
-                    'bleeding': 'நீங்கள் எந்த இரத்தப்போக்கையும் கவனித்தீர்களா? அது இலேசான, நடுத்தர, அல்லது கனமானதா?',
-                    'infection': 'உங்களுக்கு காய்ச்சல், சீழ், வெளியேற்றம் அல்லது தொற்று அறிகுறிகள் உள்ளனவா?',
-                    'delayed healing': 'காயம் சாதாரணமாக குணமாகிறதா, அல்லது குணமடைய தாமதம் குறித்த கவலைகள் உள்ளனவா?'
-                }
-                question = symptom_questions_ta.get(next_symptom, f'{next_symptom} பற்றி சொல்லுங்கள்.')
+            elif next_symptom and dialogue_stage == 'symptoms_inquiry':
+                question = SYMPTOM_QUESTIONS_TA.get(next_symptom, f'{next_symptom} பற்றி சொல்லுங்கள்.')
                 user_prompt += f"\n\nஇந்த ஒரு கேள்வியை மட்டும் கேட்கவும்: '{question}' பல கேள்விகளை கேட்காதீர்கள். பதிலுக்கு காத்திருக்கவும்."
         else:
             if should_assess_risk:
                 user_prompt += "\n\nYou have enough information. Assess risk level NOW and provide recommendations. Use format: [RISK_LEVEL: LOW/MODERATE/HIGH]"
-            elif remaining_symptoms and dialogue_stage == 'symptoms_inquiry':
-                next_symptom = remaining_symptoms[0]
-                symptom_questions = {
-                    'pain': 'Can you describe the pain? Is it mild, moderate, or severe?',
-                    'swelling': 'Is there any swelling at the surgical site? How would you describe it?',
-                    'bleeding': 'Have you noticed any bleeding? Is it light, moderate, or heavy?',
-                    'infection': 'Do you have a fever, pus, discharge, or signs of infection?',
-                    'delayed healing': 'Is the wound healing normally, or are there concerns about delayed healing?'
-                }
-                question = symptom_questions.get(next_symptom, f'Tell me about {next_symptom}.')
+            elif next_symptom and dialogue_stage == 'symptoms_inquiry':
+                question = SYMPTOM_QUESTIONS.get(next_symptom, f'Tell me about {next_symptom}.')
                 user_prompt += f"\n\nAsk ONLY this ONE question: '{question}' Do NOT ask multiple questions. Wait for answer."
                 # Track that we have prompted this symptom to avoid repetition
                 if next_symptom not in symptoms_prompted:
                     symptoms_prompted.append(next_symptom)
-                    patient_conversations[patient_id]['symptoms_prompted'] = symptoms_prompted
-                    patient_conversations[patient_id]['last_prompted_symptom'] = next_symptom
-        
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            model=GROQ_MODEL,
-            temperature=0.7,
-            max_tokens=500  # Limit response to save tokens
-        )
-        
-        response_text = chat_completion.choices[0].message.content
+                    state_updates['symptoms_prompted'] = symptoms_prompted
+                    state_updates['last_prompted_symptom'] = next_symptom
+        
+        # Hold the slot until a streamed reply has been fully read
+        async with _groq_slots:
+            chat_completion = await client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                model=GROQ_MODEL,
+                temperature=0.7,
+                max_tokens=500,  # Limit response to save tokens
+                stream=on_token is not None
+            )
+            
+            if on_token is None:
+                response_text = chat_completion.choices[0].message.content
+            else:
+                # Forward tokens as they arrive; keep the full text for risk parsing below
+                parts = []
+                async for chunk in chat_completion:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+                response_text = ''.join(parts)
         
         # Extract risk level from response
         risk_level = 'unknown'
         details = {}
         
-        if '[RISK_LEVEL: HIGH]' in response_text:
-            risk_level = 'high'
-            response_text = response_text.replace('[RISK_LEVEL: HIGH]', '').strip()
-        elif '[RISK_LEVEL: MODERATE]' in response_text:
-            risk_level = 'moderate'
-            response_text = response_text.replace('[RISK_LEVEL: MODERATE]', '').strip()
-        elif '[RISK_LEVEL: LOW]' in response_text:
-            risk_level = 'low'
-            response_text = response_text.replace('[RISK_LEVEL: LOW]', '').strip()
+        m = _RISK_TAG_RE.search(response_text)
+        if m:
+            risk_level = m.group(1).lower()
+            response_text = response_text.replace(m.group(0), '')
         
-        if '[DETAILS:' in response_text:
-            details_start = response_text.find('[DETAILS:')
-            details_end = response_text.find(']', details_start)
-            if details_end != -1:
-                details_text = response_text[details_start+9:details_end]
-                details = {'summary': details_text}
-                response_text = response_text[:details_start] + response_text[details_end+1:]
+        m = _DETAILS_TAG_RE.search(response_text)
+        if m:
+            details = {'summary': m.group(1)}
+            response_text = response_text[:m.start()] + response_text[m.end():]
         
         # Clean up response
         response_text = response_text.strip()
         
         # Add structured recommendations ONLY after full assessment
-        patient_data = patient_conversations.get(patient_id, {})
-        symptoms_count = len(patient_data.get('symptoms_asked', []))
-        dialogue_stage = patient_data.get('dialogue_stage', 'initial')
+        symptoms_count = len(symptoms_asked)
         
         # Only provide full recommendations if we've asked multiple symptoms or risk is assessed
         if risk_level == 'high':
             warning = "\n\n⚠️ HIGH RISK DETECTED ⚠️\n\nBased on your symptoms, this requires URGENT medical attention:\n\n1. Contact your doctor IMMEDIATELY\n2. Go to emergency care if symptoms are severe\n3. Do NOT delay - complications can worsen quickly\n\nYour doctor has been automatically notified."
             response_text += warning
-            # Update dialogue stage and ensure hospital dashboard is updated
-            if patient_id in patient_conversations:
-                patient_conversations[patient_id]['dialogue_stage'] = 'urgent_care'
-                patient_conversations[patient_id]['risk_level'] = 'high'
-                # Force update to hospital dashboard
-                update_patients_list(patient_id)
+            # The caller records the stage and refreshes the hospital dashboard
+            state_updates['dialogue_stage'] = 'urgent_care'
         elif risk_level == 'low' and (symptoms_count >= 3 or dialogue_stage == 'assessment_complete'):
             # Only show recommendations if we've gathered enough information
-            if 'preventive' not in response_text.lower() and 'medication' not in response_text.lower() and 'recommendation' not in response_text.lower():
-                recommendations = "\n\n💡 PREVENTIVE MEASURES & HOME CARE:\n\n"
-                surgery_info = patient_conversations.get(patient_id, {}).get('surgery_info', {})
-                surgery_type = surgery_info.get('surgery_type', 'surgery')
-                
-                recommendations += f"• Keep the surgical site clean and dry\n"
-                recommendations += f"• Take prescribed medications as directed\n"
-                recommendations += f"• Watch for signs of infection (fever, redness, pus)\n"
-                recommendations += f"• Avoid strenuous activities during recovery\n"
-                recommendations += f"• Follow your doctor's post-operative instructions\n\n"
-                recommendations += f"SUITABLE MEDICATIONS (consult doctor first):\n"
-                recommendations += f"• Pain management: Acetaminophen or Ibuprofen (as prescribed)\n"
-                recommendations += f"• Infection prevention: Keep area clean, change dressings regularly\n"
-                recommendations += f"• Swelling reduction: Apply ice packs, elevate if applicable\n\n"
-                recommendations += "⚠️ Monitor closely. Contact doctor if symptoms worsen or persist."
-                response_text += recommendations
+            lower_text = response_text.lower()
+            if 'preventive' not in lower_text and 'medication' not in lower_text and 'recommendation' not in lower_text:
+                response_text += LOW_RISK_RECOMMENDATIONS
             
-            if patient_id in patient_conversations:
-                patient_conversations[patient_id]['dialogue_stage'] = 'follow_up'
-                # Update hospital dashboard
-                update_patients_list(patient_id)
+            state_updates['dialogue_stage'] = 'follow_up'
         elif risk_level == 'low' and symptoms_count < 3:
             # Still gathering information, don't show full recommendations yet
-            if patient_id in patient_conversations:
-                patient_conversations[patient_id]['dialogue_stage'] = 'symptoms_inquiry'
+            state_updates['dialogue_stage'] = 'symptoms_inquiry'
         
         return {
             'message': response_text,
             'risk_level': risk_level,
             'details': details
-        }
+        }, state_updates
     
     except Exception as e:
         return {
             'message': f"Error processing request: {str(e)}",
             'risk_level': 'unknown',
             'details': {}
-        }
+        }, {}
+
+def patient_sort_key(entry):
+    """Dashboard order: high risk first, unknown last, then by last updated"""
+    return (entry['risk_level'] != 'high', entry['risk_level'] == 'unknown', entry['last_updated'])
+
+def remove_dashboard_entry(entry):
+    """Delete an entry from patients_data at its sorted position (caller holds _patients_lock)"""
+    pos = bisect_left(patients_data, patient_sort_key(entry), key=patient_sort_key)
+    while patients_data[pos] is not entry:
+        pos += 1
+    del patients_data[pos]
+
+def prune_dashboard():
+    """Drop least recently updated entries past the size cap or the TTL (caller holds _patients_lock).
+    High-risk patients are never dropped, however long they have been quiet; they
+    are moved to the end of the index so later scans do not walk them again.
+    """
+    cutoff = (datetime.now() - DASHBOARD_TTL).isoformat()
+    excess = len(patients_index) - DASHBOARD_MAX_PATIENTS
+    stale, exempt = [], []
+    for entry in patients_index.values():
+        if entry['risk_level'] == 'high':
+            exempt.append(entry['patient_id'])
+            continue
+        # Oldest first, so the first recent entry ends the scan once the cap is met
+        if excess <= 0 and entry['last_updated'] >= cutoff:
+            break
+        stale.append(entry)
+        excess -= 1
+    for entry in stale:
+        del patients_index[entry['patient_id']]
+        remove_dashboard_entry(entry)
+    for patient_id in exempt:
+        patients_index.move_to_end(patient_id)
 
 def update_patients_list(patient_id):
     """Update the patients list for hospital dashboard"""
-    patient_data = patient_conversations.get(patient_id, {})
+    patient_data = patient_conversations.peek(patient_id, {})
     contact = patient_data.get('contact', {})
     contact_name = (contact.get('name') or '').strip() if isinstance(contact, dict) else ''
     
-    # Find and update or create patient entry
-    patient_entry = None
-    for p in patients_data:
-        if p['patient_id'] == patient_id:
-            patient_entry = p
-            break
-    
-    if not patient_entry:
-        patient_entry = {
-            'patient_id': patient_id,
-            'name': contact_name or f'Patient {patient_id}',
-            'risk_level': patient_data.get('risk_level', 'unknown'),
-            'last_updated': datetime.now().isoformat(),
-            'details': patient_data.get('details', {}),
-            'conversation_count': len(patient_data.get('conversation', [])),
-            'upload_count': len(patient_data.get('uploads', [])),
-            'surgery_info': patient_data.get('surgery_info', {}),
-            'symptoms_asked': patient_data.get('symptoms_asked', [])
-        }
-        patients_data.append(patient_entry)
-    else:
-        if contact_name:
-            patient_entry['name'] = contact_name
-        patient_entry['risk_level'] = patient_data.get('risk_level', patient_entry['risk_level'])
-        patient_entry['last_updated'] = datetime.now().isoformat()
-        patient_entry['details'] = patient_data.get('details', patient_entry['details'])
-        patient_entry['conversation_count'] = len(patient_data.get('conversation', []))
-        patient_entry['upload_count'] = len(patient_data.get('uploads', []))
-        patient_entry['surgery_info'] = patient_data.get('surgery_info', patient_entry.get('surgery_info', {}))
-        patient_entry['symptoms_asked'] = patient_data.get('symptoms_asked', patient_entry.get('symptoms_asked', []))
-    
-    # Sort: high risk first, then by last updated
-    patients_data.sort(key=lambda x: (
-        x['risk_level'] != 'high',
-        x['risk_level'] == 'unknown',
-        x['last_updated']
-    ), reverse=False)
+    with _patients_lock:
+        patient_entry = patients_index.get(patient_id)
+        if not patient_entry:
+            patient_entry = {
+                'patient_id': patient_id,
+                'name': contact_name or f'Patient {patient_id}',
+                'risk_level': patient_data.get('risk_level', 'unknown'),
+                'last_updated': datetime.now().isoformat(),
+                'details': patient_data.get('details', {}),
+                'conversation_count': history_total(patient_data, 'conversation') if patient_data else 0,
+                'upload_count': history_total(patient_data, 'uploads') if patient_data else 0,
+                'surgery_info': patient_data.get('surgery_info', {}),
+                'symptoms_asked': patient_data.get('symptoms_asked', [])
+            }
+            patients_index[patient_id] = patient_entry
+        else:
+            # Take it out at its old position; it is re-inserted under its new key below
+            remove_dashboard_entry(patient_entry)
+            patients_index.move_to_end(patient_id)
+            if contact_name:
+                patient_entry['name'] = contact_name
+            patient_entry['risk_level'] = patient_data.get('risk_level', patient_entry['risk_level'])
+            patient_entry['last_updated'] = datetime.now().isoformat()
+            patient_entry['details'] = patient_data.get('details', patient_entry['details'])
+            if patient_data:
+                patient_entry['conversation_count'] = history_total(patient_data, 'conversation')
+                patient_entry['upload_count'] = history_total(patient_data, 'uploads')
+            patient_entry['surgery_info'] = patient_data.get('surgery_info', patient_entry.get('surgery_info', {}))
+            patient_entry['symptoms_asked'] = patient_data.get('symptoms_asked', patient_entry.get('symptoms_asked', []))
+        insort(patients_data, patient_entry, key=patient_sort_key)
+        prune_dashboard()
 
 @app.route('/api/patients', methods=['GET'])
 def get_patients():
     """Get all patients for hospital dashboard"""
-    # Sort: high risk first, then low risk, then unknown
-    sorted_patients = sorted(patients_data, key=lambda x: (
-        x['risk_level'] != 'high',
-        x['risk_level'] == 'unknown',
-        x['last_updated']
-    ))
+    # Already in dashboard order (high risk first, unknown last)
+    with _patients_lock:
+        prune_dashboard()
+        sorted_patients = list(patients_data)
     
     # Get full conversation and upload details for each patient
     for patient in sorted_patients:
         patient_id = patient['patient_id']
-        if patient_id in patient_conversations:
-            patient['full_conversation'] = patient_conversations[patient_id].get('conversation', [])
-            patient['uploads'] = patient_conversations[patient_id].get('uploads', [])
+        state = patient_conversations.peek(patient_id)
+        if state is not None:
+            # Only the in-memory window; the counts include archived entries, so the
+            # dashboard can tell when the transcript is cut short
+            patient['full_conversation'] = list(state.get('conversation', []))
+            patient['uploads'] = list(state.get('uploads', []))
+            patient['conversation_count'] = history_total(state, 'conversation')
+            patient['upload_count'] = history_total(state, 'uploads')
     
     return jsonify(sorted_patients)
 
 @app.route('/api/patient/<patient_id>', methods=['GET'])
 def get_patient_details(patient_id):
     """Get detailed information about a specific patient"""
-    if patient_id in patient_conversations:
-        return jsonify(patient_conversations[patient_id])
+    state = patient_conversations.peek(patient_id)
+    if state is not None:
+        return jsonify({**state, 'conversation': list(state['conversation']), 'uploads': list(state['uploads'])})
     return jsonify({'error': 'Patient not found'}), 404
 
+# Keyword -> tags used to place the Grad-CAM region of interest. 'upper'/'middle'/'lower'
+# pick the vertical band, 'chest'/'arm'/'pelvis'/'leg' the label, 'left'/'right' the half.
+# Matched as substrings, like the symptom keywords; same-start keywords share their tags.
+REGION_KEYWORDS = {
+    'shoulder': ('upper', 'arm'), 'elbow': ('upper', 'arm'), 'wrist': ('upper', 'arm'),
+    'hand': ('upper', 'arm'), 'clavicle': ('upper', 'arm'), 'arm': ('arm',),
+    'lung': ('upper', 'chest'), 'chest': ('upper', 'chest'), 'thorax': ('upper', 'chest'), 'rib': ('upper', 'chest'),
+    'abdomen': ('middle',), 'stomach': ('middle',), 'liver': ('middle',), 'spleen': ('middle',), 'kidney': ('middle',),
+    'hip': ('lower', 'pelvis'), 'pelvis': ('lower', 'pelvis'),
+    'knee': ('lower', 'leg'), 'ankle': ('lower', 'leg'), 'foot': ('lower', 'leg'),
+    'append': ('lower',), 'appendectomy': ('lower',), 'hernia': ('lower',),
+    'left': ('left',), 'lt': ('left',), 'lhs': ('left',), 'l.': ('left',),
+    'right': ('right',), 'rt': ('right',), 'rhs': ('right',), 'r.': ('right',),
+}
+_REGION_KEYWORD_RE = re.compile('(?=(' + '|'.join(map(re.escape, sorted(REGION_KEYWORDS, key=len, reverse=True))) + '))')
+
+def scan_region_keywords(text):
+    """Return the region tags present in lower-cased surgery text, in one regex pass"""
+    return {tag for m in _REGION_KEYWORD_RE.finditer(text) for tag in REGION_KEYWORDS[m.group(1)]}
+
+# Below this many pixels on the short side the edge-based heatmap carries no useful detail
+GRADCAM_MIN_SIZE = 128
+
+@lru_cache(maxsize=1)
+def load_cv2():
+    """Import OpenCV once, with its SIMD-optimized code paths switched on"""
+    import cv2
+    cv2.setUseOptimized(True)
+    return cv2
+
 def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
     """Analyze X-ray image using Grad-CAM to highlight important regions.
     If surgery_info is provided, restrict highlights to the expected surgery region.
+    Returns (analysis_text, gradcam_path, (w, h)); path and size are None when no overlay is saved.
     """
     if not IMAGE_AVAILABLE:
-        return "Image analysis libraries not available", None
+        return "Image analysis libraries not available", None, None
     
     try:
-        # Load and preprocess image
-        img = Image.open(image_path).convert('RGB')
-        img_array = np.array(img)
-        
-        # Resize if too large
-        if img_array.shape[0] > 512 or img_array.shape[1] > 512:
+        from PIL import Image
+        import numpy as np
+        cv2 = load_cv2()
+        
+        # Load and preprocess image. open() only reads the header, so tiny images are
+        # turned away before any pixels are decoded
+        with Image.open(image_path) as src:
+            if min(src.size) < GRADCAM_MIN_SIZE:
+                return f"Image too small for Grad-CAM analysis ({src.width}x{src.height}; need at least {GRADCAM_MIN_SIZE}px per side)", None, None
+            img = src.convert('RGB')
+        
+        # Resize if too large (checked on the PIL image, before any array is built)
+        if img.height > 512 or img.width > 512:
             img.thumbnail((512, 512), Image.Resampling.LANCZOS)
-            img_array = np.array(img)
-        
-        # Convert to grayscale if it's an X-ray (typically grayscale)
-        if len(img_array.shape) == 3:
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = img_array
+        # Read-only NumPy view over the decoded pixels, no copy
+        img_array = np.asarray(img)
         
-        # Normalize
-        gray = gray.astype(np.float32) / 255.0
+        # Convert to grayscale (X-rays are grayscale; convert('RGB') always gives 3 channels)
+        # and keep it as uint8, which is what every OpenCV step below consumes
+        g_u8 = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
         # Simplified Grad-CAM simulation with clearer highlighting
         # 1) Build an activation map using gradients/edges as a proxy
-        g_u8 = (gray * 255).astype(np.uint8)
         edges = cv2.Canny(g_u8, 50, 150)
-        sobelx = cv2.Sobel(g_u8, cv2.CV_16S, 1, 0)
-        sobely = cv2.Sobel(g_u8, cv2.CV_16S, 0, 1)
-        sobel = cv2.convertScaleAbs(cv2.addWeighted(cv2.convertScaleAbs(sobelx), 0.5, cv2.convertScaleAbs(sobely), 0.5, 0))
-        act_map = cv2.addWeighted(edges, 0.5, sobel, 0.5, 0)
+        sobelx = cv2.Sobel(g_u8, cv2.CV_32F, 1, 0)
+        sobely = cv2.Sobel(g_u8, cv2.CV_32F, 0, 1)
+        # Gradient magnitude saturated to uint8, combined with the edge map by a per-pixel max
+        sobel = cv2.convertScaleAbs(cv2.magnitude(sobelx, sobely))
+        act_map = cv2.max(edges, sobel)
 
         # 2) Smooth and normalize activation map
         act_map_blur = cv2.GaussianBlur(act_map, (9, 9), 0)
@@ -1087,6 +1584,7 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
 
         # 3) If surgery_info suggests a location, build a region-of-interest (ROI) mask
         roi_mask = None
+        roi_box = None
         region_note = None
         location_label = None
         if isinstance(surgery_info, dict) and surgery_info:
@@ -1102,36 +1600,38 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
             left_half = (0, 0, w//2, h)
             right_half = (w//2, 0, w, h)
 
+            hits = scan_region_keywords(st)
+
             # Choose vertical band
-            if any(k in st for k in ['shoulder', 'elbow', 'wrist', 'hand', 'clavicle', 'lung', 'chest', 'thorax', 'rib']):
+            if 'upper' in hits:
                 ysel = upper_band
                 region_note = 'upper'
                 # Label
-                if any(k in st for k in ['lung', 'chest', 'thorax', 'rib']):
+                if 'chest' in hits:
                     location_label = 'Chest/Thorax'
-                elif any(k in st for k in ['shoulder', 'clavicle', 'arm', 'elbow', 'wrist', 'hand']):
+                elif 'arm' in hits:
                     location_label = 'Shoulder/Arm'
-            elif any(k in st for k in ['abdomen', 'stomach', 'liver', 'spleen', 'kidney']):
+            elif 'middle' in hits:
                 ysel = middle_band
                 region_note = 'middle'
                 location_label = 'Abdomen'
-            elif any(k in st for k in ['hip', 'pelvis', 'knee', 'ankle', 'foot', 'append', 'appendectomy', 'hernia']):
+            elif 'lower' in hits:
                 ysel = lower_band
                 region_note = 'lower'
-                if any(k in st for k in ['hip', 'pelvis']):
+                if 'pelvis' in hits:
                     location_label = 'Pelvis/Hips'
-                elif any(k in st for k in ['knee', 'ankle', 'foot']):
+                elif 'leg' in hits:
                     location_label = 'Knee/Leg'
             else:
                 ysel = (0, 0, w, h)
 
             # Choose left/right if specified
-            if any(k in st for k in ['left', 'lt', 'lhs', 'l.']):
+            if 'left' in hits:
                 xsel = left_half
                 region_note = f"left {region_note or ''}".strip()
                 if location_label:
                     location_label = f"Left {location_label}"
-            elif any(k in st for k in ['right', 'rt', 'rhs', 'r.']):
+            elif 'right' in hits:
                 xsel = right_half
                 region_note = f"right {region_note or ''}".strip()
                 if location_label:
@@ -1144,28 +1644,20 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
             xB0, yB0, xB1, yB1 = ysel
             x0, y0 = max(xA0, xB0), max(yA0, yB0)
             x1, y1 = min(xA1, xB1), min(yA1, yB1)
+            roi_box = (x0, y0, x1, y1)
             roi_mask = np.zeros_like(act_map_norm, dtype=np.uint8)
             roi_mask[y0:y1, x0:x1] = 255
 
         # 4) If ROI exists, zero activations outside it so ONLY the affected part is colored
-        inner_roi_mask = None
+        inner_box = None
         if roi_mask is not None:
             act_map_norm = cv2.bitwise_and(act_map_norm, roi_mask)
-            # Build an inner ROI (shrunken by 10%) to bias selection toward the core region
-            try:
-                w_roi = x1 - x0
-                h_roi = y1 - y0
-                inset_x = max(1, int(0.1 * w_roi))
-                inset_y = max(1, int(0.1 * h_roi))
-                ix0, iy0 = x0 + inset_x, y0 + inset_y
-                ix1, iy1 = x1 - inset_x, y1 - inset_y
-                inner_roi_mask = np.zeros_like(roi_mask, dtype=np.uint8)
-                if ix1 > ix0 and iy1 > iy0:
-                    inner_roi_mask[iy0:iy1, ix0:ix1] = 255
-                else:
-                    inner_roi_mask = roi_mask.copy()
-            except Exception:
-                inner_roi_mask = roi_mask.copy()
+            # Inner ROI box (shrunken by 10%) to bias selection toward the core region
+            inset_x = max(1, int(0.1 * (x1 - x0)))
+            inset_y = max(1, int(0.1 * (y1 - y0)))
+            ix0, iy0 = x0 + inset_x, y0 + inset_y
+            ix1, iy1 = x1 - inset_x, y1 - inset_y
+            inner_box = (ix0, iy0, ix1, iy1) if ix1 > ix0 and iy1 > iy0 else roi_box
 
         # 5) Create color heatmap from the (possibly masked) activations
         heatmap = cv2.applyColorMap(act_map_norm, cv2.COLORMAP_VIRIDIS)
@@ -1176,20 +1668,23 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
 
         # 7) Highlight top-activation regions with contour outlines, restricted by ROI if present
         # Threshold at high percentile to get hotspots (tighten to 90th)
-        thresh_val = int(np.percentile(act_map_norm.flatten(), 90))
+        # uint8 map: read the percentile off a 256-bin histogram instead of sorting every pixel
+        cdf = np.cumsum(cv2.calcHist([act_map_norm], [0], None, [256], [0, 256]).ravel())
+        thresh_val = int(np.searchsorted(cdf, int(0.9 * (act_map_norm.size - 1)), side='right'))
         _, mask = cv2.threshold(act_map_norm, thresh_val, 255, cv2.THRESH_BINARY)
         if roi_mask is not None:
-            # Emphasize ROI center using a Gaussian weight
-            ry, rx = np.where(roi_mask > 0)
-            if len(ry) > 0:
-                y0, y1 = ry.min(), ry.max()
-                x0, x1 = rx.min(), rx.max()
+            # Emphasize ROI center using a Gaussian weight; the ROI is the box from step 3,
+            # taken with inclusive bounds
+            x0, y0, x1, y1 = roi_box
+            x1, y1 = x1 - 1, y1 - 1
+            if y1 >= y0 and x1 >= x0:
                 cy, cx = (y0 + y1) // 2, (x0 + x1) // 2
-                yy, xx = np.mgrid[0:h_map, 0:w_map]
                 sigma_y = max(5, (y1 - y0) / 4)
                 sigma_x = max(5, (x1 - x0) / 4)
-                gauss = np.exp(-(((yy - cy) ** 2) / (2 * sigma_y ** 2) + ((xx - cx) ** 2) / (2 * sigma_x ** 2)))
-                gauss = (255 * (gauss / gauss.max())).astype(np.uint8)
+                # The 2D Gaussian is separable: outer product of two 1D profiles, peak 1 at (cy, cx)
+                gy = np.exp(-((np.arange(h_map) - cy) ** 2) / (2 * sigma_y ** 2))
+                gx = np.exp(-((np.arange(w_map) - cx) ** 2) / (2 * sigma_x ** 2))
+                gauss = np.outer(255 * gy, gx).astype(np.uint8)
                 weighted = cv2.multiply(mask, gauss, scale=1/255.0)
                 mask = cv2.bitwise_and(weighted, roi_mask)
             else:
@@ -1201,19 +1696,23 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         # Filter contours to those overlapping the INNER ROI core when available
         filtered_contours = []
-        if inner_roi_mask is not None:
-            for cnt in contours:
-                tmp = np.zeros_like(mask)
-                cv2.drawContours(tmp, [cnt], -1, 255, thickness=-1)
-                overlap = cv2.countNonZero(cv2.bitwise_and(tmp, inner_roi_mask))
-                area_cnt = max(1, cv2.countNonZero(tmp))
-                if overlap / float(area_cnt) >= 0.3:  # at least 30% inside inner ROI
-                    filtered_contours.append(cnt)
-        else:
+        if inner_box is not None and contours:
+            # Paint every filled contour with its own label once, then count each label's
+            # pixels overall and inside the inner ROI (external contours do not overlap)
+            labels = np.zeros(mask.shape, dtype=np.int32)
+            for i, cnt in enumerate(contours, 1):
+                cv2.drawContours(labels, [cnt], -1, i, thickness=-1)
+            n = len(contours) + 1
+            area_cnt = np.maximum(np.bincount(labels.ravel(), minlength=n), 1)
+            ix0, iy0, ix1, iy1 = inner_box
+            overlap = np.bincount(labels[iy0:iy1, ix0:ix1].ravel(), minlength=n)
+            keep = overlap / area_cnt >= 0.3  # at least 30% inside inner ROI
+            filtered_contours = [cnt for i, cnt in enumerate(contours, 1) if keep[i]]
+        elif inner_box is None:
             filtered_contours = contours
 
         # Fallback if nothing passes filter: keep the largest original contour (if any)
-        if inner_roi_mask is not None and not filtered_contours and contours:
+        if inner_box is not None and not filtered_contours and contours:
             largest = max(contours, key=cv2.contourArea)
             filtered_contours = [largest]
 
@@ -1245,263 +1744,246 @@ def analyze_xray_with_gradcam(image_path, filename, surgery_info=None):
             "- Areas of interest outlined in teal within the surgery region and emphasized on the heatmap"
         )
         
-        return analysis_text, gradcam_path
+        return analysis_text, gradcam_path, (overlay.shape[1], overlay.shape[0])
     except Exception as e:
-        return f"X-ray analysis completed with basic processing. Error: {str(e)}", None
+        return f"X-ray analysis completed with basic processing. Error: {str(e)}", None, None
+
+def wrap_greedy(text, max_chars, max_lines=None):
+    """Greedy word wrap to lines of at most max_chars (longer words get their own line).
+    Stops once max_lines lines are complete.
+    """
+    words = text.split()
+    # ends[i] is the length of words[:i] joined with a trailing space each, so a line
+    # words[start:end] fits when ends[end] - ends[start] - 1 <= max_chars
+    ends = [0, *accumulate(len(w) + 1 for w in words)]
+    lines = []
+    start = 0
+    while start < len(words) and (max_lines is None or len(lines) < max_lines):
+        end = max(bisect_right(ends, ends[start] + max_chars + 1) - 1, start + 1)
+        lines.append(' '.join(words[start:end]))
+        start = end
+    return lines
+
+@lru_cache(maxsize=256)
+def read_image_size(path, mtime):
+    from reportlab.lib.utils import ImageReader
+    return ImageReader(path).getSize()
+
+def get_image_size(path):
+    """Pixel size of an image file, decoded once and reused until the file changes"""
+    return read_image_size(os.path.realpath(path), os.path.getmtime(path))
+
+@lru_cache(maxsize=256)
+def read_file_digest(path, mtime):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def get_file_digest(path):
+    """Content hash of a file, reused until the file changes"""
+    return read_file_digest(os.path.realpath(path), os.path.getmtime(path))
+
+def ensure_thumbnail(path, max_h=220, max_w_px=612 - 120, size=None):
+    """Report-sized JPEG copy of an image, saved next to it as {path}.thumb.jpg.
+    Rebuilt only when the source is newer. Returns (thumb_path, (w, h)), where (w, h)
+    is the thumbnail's size, or the known source size if given (same aspect ratio).
+    max_w_px defaults to letter width minus the report margins
+    """
+    thumb_path = f"{path}.thumb.jpg"
+    if not os.path.exists(thumb_path) or os.path.getmtime(thumb_path) < os.path.getmtime(path):
+        from PIL import Image
+        with Image.open(path) as im:
+            im = im.convert('RGB')
+            im.thumbnail((max_w_px, max_h), Image.LANCZOS)
+            # Write then rename so a concurrent report never reads a partial file
+            tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            im.save(tmp_path, 'JPEG', quality=82, optimize=True)
+            size = size or im.size
+        os.replace(tmp_path, thumb_path)
+    return thumb_path, size or get_image_size(thumb_path)
+
+def surgery_focus_text(si):
+    """Escaped 'Surgery focus: type (side site)' label, or '' without a surgery type"""
+    if not si.get('surgery_type'):
+        return ''
+    focus_text = f"Surgery focus: {si['surgery_type']}"
+    extra = f"{si.get('side') or ''} {si.get('site') or ''}".strip()
+    if extra:
+        focus_text += f" ({extra})"
+    return escape(focus_text)
+
+def prepare_report_image(path, max_w, max_h, size=None):
+    """Report copy, pixel size and content digest of one image, or None if it can't be read.
+    A size recorded at Grad-CAM time is used as is, saving a decode of the image header
+    """
+    try:
+        if IMAGE_AVAILABLE:
+            img_path, size = ensure_thumbnail(path, max_h, max_w, size)
+        else:
+            img_path, size = path, size or get_image_size(path)
+        return img_path, size, get_file_digest(img_path)
+    except Exception:
+        return None
+
+@lru_cache(maxsize=1)
+def report_styles():
+    """Paragraph styles for the PDF report, built once and shared by every report"""
+    from reportlab.lib.enums import TA_JUSTIFY
+    from reportlab.lib.styles import ParagraphStyle
+    return {
+        'title': ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=20, leading=24, spaceAfter=26),
+        'section': ParagraphStyle('section', fontName='Helvetica-Bold', fontSize=14, leading=18, spaceBefore=12, spaceAfter=7),
+        'body': ParagraphStyle('body', fontName='Helvetica', fontSize=12, leading=20),
+        'detail': ParagraphStyle('detail', fontName='Helvetica', fontSize=10, leading=15, leftIndent=20),
+        'caption': ParagraphStyle('caption', fontName='Helvetica-Oblique', fontSize=11, leading=14, leftIndent=20, spaceBefore=5),
+        'msg_header': ParagraphStyle('msg_header', fontName='Helvetica-Bold', fontSize=10, leading=12),
+        'msg_body': ParagraphStyle('msg_body', fontName='Helvetica', fontSize=10, leading=12, leftIndent=10, spaceAfter=6, alignment=TA_JUSTIFY),
+        'summary': ParagraphStyle('summary', fontName='Helvetica', fontSize=12, leading=20, alignment=TA_JUSTIFY),
+    }
+
+REPORT_SPOOL_SIZE = 2 * 1024 * 1024
+
+# Transcript labels by message role; anything else is the assistant
+ROLE_LABELS = {'user': 'Patient'}
+# Report layout is CPU-bound; a small dedicated pool caps how many run at once
+# without competing with uploads for EXECUTOR
+REPORT_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='report-build')
+
+def warm_report_engine():
+    """Build a throwaway PDF so the first real report skips ReportLab's imports and font setup"""
+    from io import BytesIO
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+    SimpleDocTemplate(BytesIO()).build([Paragraph("warm-up", style) for style in report_styles().values()])
+
+# Opt-in: warming loads platypus and the font metrics into every worker at startup,
+# which chat-only deployments that never build reports would rather avoid
+REPORT_WARMUP = os.getenv('REPORT_WARMUP', '0') == '1'
+if REPORT_AVAILABLE and REPORT_WARMUP:
+    REPORT_EXECUTOR.submit(warm_report_engine)
 
 @app.route('/api/download-report/<patient_id>', methods=['GET'])
 def download_report(patient_id):
     """Generate and download patient report as PDF"""
-    if patient_id not in patient_conversations:
+    patient_data = patient_conversations.peek(patient_id)
+    if patient_data is None:
         return jsonify({'error': 'Patient not found'}), 404
     
     if not REPORT_AVAILABLE:
         return jsonify({'error': 'PDF generation not available'}), 500
     
     try:
-        from io import BytesIO
-        patient_data = patient_conversations[patient_id]
-        
-        # Create PDF
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        # Title
-        c.setFont("Helvetica-Bold", 20)
-        c.drawString(50, height - 50, "Medical Report - Patient Analysis")
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as PDFImage
         
-        y_position = height - 100
+        styles = report_styles()
+        # Paragraph text is markup, so anything taken from patient data is escaped
+        story = [Paragraph("Medical Report - Patient Analysis", styles['title'])]
         
         # Patient Information
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y_position, "Patient Information")
-        y_position -= 25
-        
-        c.setFont("Helvetica", 12)
-        c.drawString(50, y_position, f"Patient ID: {patient_id}")
-        y_position -= 20
-        c.drawString(50, y_position, f"Risk Level: {patient_data.get('risk_level', 'Unknown').upper()}")
-        y_position -= 20
-        c.drawString(50, y_position, f"Report Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        y_position -= 40
+        story.append(Paragraph("Patient Information", styles['section']))
+        story.append(Paragraph(f"Patient ID: {escape(patient_id)}", styles['body']))
+        story.append(Paragraph(f"Risk Level: {escape(patient_data.get('risk_level', 'Unknown').upper())}", styles['body']))
+        story.append(Paragraph(f"Report Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['body']))
+        story.append(Spacer(1, 20))
         
         # Surgery Information
         surgery_info = patient_data.get('surgery_info', {})
         if surgery_info.get('surgery_type'):
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y_position, "Surgery Information")
-            y_position -= 25
-            
-            c.setFont("Helvetica", 12)
-            c.drawString(50, y_position, f"Surgery Type: {surgery_info.get('surgery_type', 'N/A')}")
-            y_position -= 20
+            story.append(Paragraph("Surgery Information", styles['section']))
+            story.append(Paragraph(f"Surgery Type: {escape(str(surgery_info.get('surgery_type', 'N/A')))}", styles['body']))
             if surgery_info.get('surgery_date'):
-                c.drawString(50, y_position, f"Surgery Date: {surgery_info.get('surgery_date', 'N/A')}")
-                y_position -= 20
-            y_position -= 20
+                story.append(Paragraph(f"Surgery Date: {escape(str(surgery_info.get('surgery_date', 'N/A')))}", styles['body']))
+            story.append(Spacer(1, 20))
         
         # Uploaded Files
         uploads = patient_data.get('uploads', [])
         if uploads:
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y_position, "Uploaded Files")
-            y_position -= 25
-            
-            c.setFont("Helvetica", 12)
-            for upload in uploads[-5:]:  # Last 5 uploads
-                if y_position < 100:
-                    c.showPage()
-                    y_position = height - 50
-                
-                c.drawString(50, y_position, f"File: {upload.get('filename', 'N/A')}")
-                y_position -= 15
+            story.append(Paragraph("Uploaded Files", styles['section']))
+            max_img_width = letter[0] - 120
+            max_img_height = 220
+            # ReportLab shares one XObject per image path, so identical images
+            # (e.g. the same scan uploaded twice) are all drawn from the first path
+            embedded_images = {}
+            prepared_images = {}
+            recent_uploads = last_n(uploads, 5)  # Last 5 uploads
+            # Grad-CAM path -> size recorded when it was generated (None for older uploads)
+            recorded_sizes = {u['gradcam_image_path']: u.get('gradcam_size') for u in recent_uploads if u.get('gradcam_image_path')}
+            # Text-only uploads skip the pool hand-off and the focus label
+            if recorded_sizes:
+                patient_focus_text = surgery_focus_text(patient_data.get('surgery_info') or {})
+                # Missing or unreadable files come back from prepare_report_image as None
+                gradcam_paths = list(recorded_sizes)
+                # Read and resize all Grad-CAM images in parallel instead of one disk round trip per upload
+                prepared_images = dict(zip(gradcam_paths, EXECUTOR.map(
+                    prepare_report_image, gradcam_paths, repeat(int(max_img_width)), repeat(max_img_height),
+                    [recorded_sizes[p] for p in gradcam_paths])))
+            for upload in recent_uploads:
+                story.append(Paragraph(f"File: {escape(upload.get('filename', 'N/A'))}", styles['body']))
                 analysis = upload.get('analysis', '')
                 if analysis:
-                    # Wrap long text
-                    text_lines = []
-                    words = analysis.split()
-                    current_line = ""
-                    for word in words:
-                        if len(current_line + word) < 80:
-                            current_line += word + " "
-                        else:
-                            text_lines.append(current_line)
-                            current_line = word + " "
-                    if current_line:
-                        text_lines.append(current_line)
-                    
-                    for line in text_lines[:5]:  # Limit to 5 lines
-                        if y_position < 100:
-                            c.showPage()
-                            y_position = height - 50
-                        c.setFont("Helvetica", 10)
-                        c.drawString(70, y_position, line[:90])
-                        y_position -= 15
+                    # Limit to the first 5 lines of wrapped text
+                    text_lines = wrap_greedy(analysis, 80, max_lines=5)
+                    story.append(Paragraph(escape(' '.join(text_lines)), styles['detail']))
                 
                 # If Grad-CAM is present for this upload, embed image and brief analysis
                 gradcam_path = upload.get('gradcam_image_path')
                 gradcam_text = upload.get('gradcam_analysis')
-                if gradcam_path and os.path.exists(gradcam_path):
+                prepared = prepared_images.get(gradcam_path)
+                if prepared:
                     try:
-                        # Space before image
-                        y_position -= 5
-                        if y_position < 200:
-                            c.showPage()
-                            y_position = height - 50
-                        c.setFont("Helvetica-Oblique", 11)
-                        c.drawString(70, y_position, "Grad-CAM Visualization (areas of interest highlighted)")
-                        y_position -= 10
+                        block = [Paragraph("Grad-CAM Visualization (areas of interest highlighted)", styles['caption'])]
                         # Add surgery focus label if available
                         # Prefer upload-level surgery_info, fallback to patient-level
-                        try:
-                            upload_si = upload.get('surgery_info', {}) or {}
-                            patient_si = patient_data.get('surgery_info', {}) or {}
-                            si = upload_si if upload_si.get('surgery_type') else patient_si
-                            if si and si.get('surgery_type'):
-                                focus_text = f"Surgery focus: {si.get('surgery_type','')}"
-                                side = si.get('side') or ''
-                                site = si.get('site') or ''
-                                extra = ' '.join([x for x in [side, site] if x])
-                                if extra:
-                                    focus_text += f" ({extra})"
-                                c.setFont("Helvetica", 10)
-                                c.drawString(70, y_position, focus_text[:100])
-                                y_position -= 12
-                        except Exception:
-                            pass
+                        upload_si = upload.get('surgery_info') or {}
+                        focus_text = surgery_focus_text(upload_si) if upload_si.get('surgery_type') else patient_focus_text
+                        if focus_text:
+                            block.append(Paragraph(focus_text, styles['detail']))
+                        # Embed the pre-sized thumbnail rather than the full-resolution overlay
+                        img_path, (img_w, img_h), digest = prepared
+                        img_path = embedded_images.setdefault(digest, img_path)
                         # Fit image to page width with max height
-                        max_img_width = width - 120
-                        max_img_height = 220
-                        img_reader = ImageReader(gradcam_path)
-                        img_w, img_h = img_reader.getSize()
                         scale = min(max_img_width / img_w, max_img_height / img_h)
-                        draw_w = img_w * scale
-                        draw_h = img_h * scale
-                        c.drawImage(img_reader, 70, y_position - draw_h, width=draw_w, height=draw_h)
-                        y_position -= (draw_h + 10)
+                        block.append(PDFImage(img_path, width=img_w * scale, height=img_h * scale, hAlign='LEFT'))
                         # Grad-CAM analysis text (1-2 lines)
                         if gradcam_text:
-                            c.setFont("Helvetica", 10)
-                            lines = []
-                            words = gradcam_text.split()
-                            curr = ""
-                            for w in words:
-                                if len(curr + w) < 90:
-                                    curr += w + " "
-                                else:
-                                    lines.append(curr)
-                                    curr = w + " "
-                            if curr:
-                                lines.append(curr)
-                            for line in lines[:2]:
-                                if y_position < 100:
-                                    c.showPage()
-                                    y_position = height - 50
-                                c.drawString(70, y_position, line[:100])
-                                y_position -= 14
+                            block.append(Paragraph(escape(' '.join(wrap_greedy(gradcam_text, 90, max_lines=2))), styles['detail']))
+                        story.extend(block)
                     except Exception:
                         # If embedding fails, continue without blocking report generation
                         pass
-
-                y_position -= 10
+                story.append(Spacer(1, 10))
         
         # Conversation Summary
-        conversation = patient_data.get('conversation', [])
+        # Include messages archived out of the in-memory window so the transcript is complete
+        conversation = get_patient_history_from_db(patient_id, 'conversation') + list(patient_data.get('conversation', []))
         if conversation:
-            if y_position < 150:
-                c.showPage()
-                y_position = height - 50
-            
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y_position, "Conversation Summary")
-            y_position -= 25
-            
-            c.setFont("Helvetica", 12)
-            c.drawString(50, y_position, f"Total Messages: {len(conversation)}")
-            y_position -= 20
+            story.append(Paragraph("Conversation Summary", styles['section']))
+            story.append(Paragraph(f"Total Messages: {len(conversation)}", styles['body']))
             
             # Symptoms asked
             symptoms = patient_data.get('symptoms_asked', [])
             if symptoms:
-                c.drawString(50, y_position, f"Symptoms Discussed: {', '.join(symptoms)}")
-                y_position -= 20
-
-            # Full Conversation
-            if y_position < 120:
-                c.showPage()
-                y_position = height - 50
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y_position, "Full Conversation")
-            y_position -= 20
-            c.setFont("Helvetica", 10)
-            # Print each message chronologically
+                story.append(Paragraph(f"Symptoms Discussed: {escape(', '.join(symptoms))}", styles['body']))
+
+            # Full Conversation, each message chronologically
+            story.append(Paragraph("Full Conversation", styles['section']))
+            header_style, body_style = styles['msg_header'], styles['msg_body']
             for msg in conversation:
-                role = 'Patient' if msg.get('role') == 'user' else 'Assistant'
-                timestamp = msg.get('timestamp', '')
-                header = f"{role} ({timestamp}):"
-                # Header line
-                if y_position < 80:
-                    c.showPage()
-                    y_position = height - 50
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(50, y_position, header[:110])
-                y_position -= 12
-                # Message content wrapped
-                c.setFont("Helvetica", 10)
-                content_text = (msg.get('content') or '').replace('\r', '')
-                words = content_text.split()
-                line = ''
-                for w in words:
-                    if len(line + w) < 110:
-                        line += w + ' '
-                    else:
-                        if y_position < 70:
-                            c.showPage()
-                            y_position = height - 50
-                            c.setFont("Helvetica", 10)
-                        c.drawString(60, y_position, line[:120])
-                        y_position -= 12
-                        line = w + ' '
-                if line:
-                    if y_position < 70:
-                        c.showPage()
-                        y_position = height - 50
-                        c.setFont("Helvetica", 10)
-                    c.drawString(60, y_position, line[:120])
-                    y_position -= 14
-                # Spacer between messages
-                y_position -= 4
+                header = ROLE_LABELS.get(msg.get('role'), 'Assistant') + ' (' + str(msg.get('timestamp', '')) + '):'
+                story.append(Paragraph(escape(header), header_style))
+                story.append(Paragraph(escape(msg.get('content') or ''), body_style))
         
         # Recommendations
         details = patient_data.get('details', {})
         if details.get('summary'):
-            if y_position < 100:
-                c.showPage()
-                y_position = height - 50
-            
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y_position, "Summary & Recommendations")
-            y_position -= 25
-            
-            c.setFont("Helvetica", 12)
-            summary = details.get('summary', '')
-            words = summary.split()
-            current_line = ""
-            for word in words:
-                if len(current_line + word) < 80:
-                    current_line += word + " "
-                else:
-                    c.drawString(50, y_position, current_line)
-                    y_position -= 15
-                    current_line = word + " "
-                    if y_position < 100:
-                        c.showPage()
-                        y_position = height - 50
-            if current_line:
-                c.drawString(50, y_position, current_line)
-        
-        c.save()
+            story.append(Paragraph("Summary & Recommendations", styles['section']))
+            story.append(Paragraph(escape(str(details.get('summary', ''))), styles['summary']))
+        
+        # Flowables are laid out, wrapped and paginated by platypus. The finished PDF
+        # spills to a temp file past REPORT_SPOOL_SIZE, so a slow download of a large
+        # report does not keep it resident
+        buffer = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE)
+        doc = SimpleDocTemplate(buffer, pagesize=letter, leftMargin=50, rightMargin=50, topMargin=50, bottomMargin=50)
+        REPORT_EXECUTOR.submit(doc.build, story).result()
         buffer.seek(0)
         
         # Return PDF
@@ -1522,7 +2004,9 @@ def get_gradcam_image(filename):
     try:
         gradcam_path = os.path.join(app.config['UPLOAD_FOLDER'], f"gradcam_{filename}")
         if os.path.exists(gradcam_path):
-            return send_file(gradcam_path, mimetype='image/jpeg')
+            # Upload names carry a timestamp, so an overlay never changes under the same URL.
+            # Browsers may reuse it for a day, then revalidate (If-None-Match -> 304).
+            return send_file(gradcam_path, mimetype='image/jpeg', conditional=True, etag=True, max_age=86400)
         return jsonify({'error': 'Grad-CAM image not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -219,6 +219,10 @@ function showPatientDetails(patientId) {
     let conversationHtml = '';
     if (patient.full_conversation && patient.full_conversation.length > 0) {
         conversationHtml = '<div class="modal-section"><h3>Conversation History</h3>';
+        const totalMessages = patient.conversation_count || 0;
+        if (totalMessages > patient.full_conversation.length) {
+            conversationHtml += `<p><em>Showing the last ${patient.full_conversation.length} of ${totalMessages} messages. Download the report for the full transcript.</em></p>`;
+        }
         patient.full_conversation.forEach(msg => {
             const timestamp = new Date(msg.timestamp).toLocaleString();
             conversationHtml += `
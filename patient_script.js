@@ -407,23 +407,15 @@ async function sendMessage() {
     const typingId = addTypingIndicator();
 
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                patient_id: patientId,
-                message: message,
-                language: currentLanguage
-            })
-        });
+        const { ok, data } = await streamChat({
+            patient_id: patientId,
+            message: message,
+            language: currentLanguage
+        }, typingId);
 
         removeTypingIndicator(typingId);
 
-        const data = await response.json();
-
-        if (response.ok) {
+        if (ok) {
             addMessage('bot', data.message);
 
             const level = (data.risk_level || '').toLowerCase();
@@ -471,6 +463,45 @@ async function sendMessage() {
     }
 }
 
+// Send a chat turn to /api/chat/stream. Tokens are rendered into the typing bubble as they
+// arrive; resolves with the final response the server scored and trimmed.
+async function streamChat(payload, typingId) {
+    const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    });
+    if (!response.ok || !response.body) {
+        return { ok: false, data: await response.json() };
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamed = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            if (!rawEvent.startsWith('data: ')) continue;
+            const event = JSON.parse(rawEvent.slice(6));
+            if (event.token) {
+                streamed += event.token;
+                updateTypingIndicator(typingId, streamed);
+            } else if (event.error) {
+                return { ok: false, data: { error: event.error } };
+            } else if (event.done) {
+                return { ok: true, data: event.response };
+            }
+        }
+    }
+    return { ok: false, data: { error: 'Connection closed before the reply finished' } };
+}
+
 function addMessage(role, content) {
     const messagesDiv = document.getElementById('chatMessages');
     const messageDiv = document.createElement('div');
@@ -504,6 +535,17 @@ function addTypingIndicator() {
     return 'typing-indicator';
 }
 
+function updateTypingIndicator(id, text) {
+    const typingDiv = document.getElementById(id);
+    if (!typingDiv) return;
+    typingDiv.querySelector('.message-content').innerHTML = `
+        <strong>Medical Assistant:</strong>
+        ${escapeHtml(text).replace(/\n/g, '<br>')}
+    `;
+    const messagesDiv = document.getElementById('chatMessages');
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+}
+
 function removeTypingIndicator(id) {
     const typingDiv = document.getElementById(id);
     if (typingDiv) {
@@ -646,14 +688,9 @@ async function requestNextQuestion() {
 
     const typingId = addTypingIndicator();
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ patient_id: patientId, message: '', language: currentLanguage })
-        });
+        const { ok, data } = await streamChat({ patient_id: patientId, message: '', language: currentLanguage }, typingId);
         removeTypingIndicator(typingId);
-        const data = await response.json();
-        if (response.ok) {
+        if (ok) {
             if (data && data.message) addMessage('bot', data.message);
             const level = (data.risk_level || '').toLowerCase();
             if (level && level !== 'unknown') {